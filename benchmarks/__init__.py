@@ -0,0 +1,28 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Benchmarks for the wpschema query paths and the hot loops of the
+wpschema._waveplot client. Run them with:
+
+    python -m benchmarks.run --seed --scale 100000 --output results.json
+
+against the database given by --database (default
+postgresql:///waveplot_bench), and compare two sets of results with:
+
+    python -m benchmarks.compare before.json after.json
+"""
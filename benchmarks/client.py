@@ -0,0 +1,142 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Micro-benchmarks of the conversions between the full waveform bytes of a
+wpschema._waveplot.WavePlot and the native waveplot structure, and of the
+previews, thumbnails and sonic hashes derived from it.
+
+libwaveplot is used if it's installed. Otherwise StubLib stands in for it,
+so that the Python side of each conversion can still be timed.
+"""
+
+import ctypes
+
+import numpy
+
+from wpschema import _waveplot
+from wpschema._waveplot import WavePlot, pack_waveplot, unpack_waveplot
+
+DEFAULT_FULL_BYTES = 10000
+
+
+def _starts(length, count):
+    """Returns the start indices of count nearly equal chunks."""
+    return numpy.arange(count) * length // count
+
+
+class StubLib(object):
+    """A pure Python stand-in for the parts of libwaveplot used to derive
+    data from a full waveform. The results are plausible rather than
+    identical to libwaveplot's, so only the timings are meaningful.
+    """
+
+    def __init__(self):
+        # Resample buffers, kept alive until their waveplot is freed.
+        self._buffers = {}
+
+    def init(self):
+        pass
+
+    def version(self):
+        return b'STUB'
+
+    def alloc_waveplot(self):
+        return ctypes.pointer(_waveplot._WavePlot())
+
+    def free_waveplot(self, w_ptr):
+        self._buffers.pop(ctypes.addressof(w_ptr.contents), None)
+
+    def resample_waveplot(self, w_ptr, width, half_height):
+        waveplot = w_ptr.contents
+        values = _waveplot._float_array(waveplot.values, waveplot.length)
+
+        resampled = numpy.zeros(width, dtype=numpy.float32)
+        if len(values):
+            resampled[:] = numpy.maximum.reduceat(
+                values, _starts(len(values), width)
+            ) * half_height
+
+        buffer = numpy.ctypeslib.as_ctypes(resampled)
+        self._buffers[ctypes.addressof(waveplot)] = buffer
+        waveplot.resample = ctypes.cast(buffer, ctypes.POINTER(ctypes.c_float))
+
+    def generate_sonic_hash(self, w_ptr):
+        waveplot = w_ptr.contents
+        values = _waveplot._float_array(waveplot.values, waveplot.length)
+
+        if not len(values):
+            return 0
+
+        sums = numpy.add.reduceat(values, _starts(len(values), 16))
+        bits = sums > 0.5 * len(values) / 16
+        return int(numpy.dot(bits, 1 << numpy.arange(16)))
+
+
+def load_lib():
+    """Loads libwaveplot, or StubLib if it isn't installed. Returns the name
+    of the library loaded, 'libwaveplot' or 'stub'.
+    """
+
+    if WavePlot.lib is not None:
+        return 'stub' if isinstance(WavePlot.lib, StubLib) else 'libwaveplot'
+
+    try:
+        WavePlot._init_libwaveplot()
+        return 'libwaveplot'
+    except OSError:
+        WavePlot.lib = StubLib()
+        return 'stub'
+
+
+def synthetic_waveplot(full_bytes=DEFAULT_FULL_BYTES, seed=0):
+    """Returns a WavePlot with a random full waveform of the given length."""
+
+    waveplot = WavePlot()
+    random = numpy.random.RandomState(seed)
+    waveplot.full = random.randint(0, 201, full_bytes).astype(
+        numpy.uint8
+    ).tobytes()
+    waveplot.version = u'DAMSON'
+    return waveplot
+
+
+def benchmarks(waveplot):
+    """Returns a list of (name, function) tuples, where each function takes
+    an iteration number and exercises one conversion of waveplot.
+    """
+
+    frame = pack_waveplot({'version': waveplot.version}, waveplot.full)
+
+    def waveplot_ptr(i):
+        waveplot._free_waveplot_ptr(waveplot._get_waveplot_ptr())
+
+    def pack(i):
+        pack_waveplot({'version': waveplot.version}, waveplot.full)
+
+    def unpack(i):
+        unpack_waveplot(frame)
+
+    return [
+        ('waveplot_ptr', waveplot_ptr),
+        ('preview', lambda i: waveplot.generate_preview()),
+        ('thumbnail', lambda i: waveplot.generate_thumbnail()),
+        ('sonic_hash', lambda i: waveplot.generate_sonic_hash()),
+        ('derive_all', lambda i: waveplot.derive_all()),
+        ('pack', pack),
+        ('unpack', unpack),
+    ]
@@ -0,0 +1,83 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Compares two sets of benchmark results written by benchmarks.run:
+
+    python -m benchmarks.compare before.json after.json
+
+Each benchmark's median time is compared, and the exit status is 1 if any
+benchmark is slower by more than the threshold.
+"""
+
+import argparse
+import json
+import sys
+
+DEFAULT_THRESHOLD = 0.1
+
+
+def compare(before, after, threshold=DEFAULT_THRESHOLD):
+    """Returns a list of (name, before median, after median, change,
+    regressed) tuples for the benchmarks in both results, where change is
+    the fractional change in median time.
+    """
+
+    rows = []
+    for name in sorted(set(before['benchmarks']) & set(after['benchmarks'])):
+        old = before['benchmarks'][name]['median']
+        new = after['benchmarks'][name]['median']
+        change = (new - old) / old if old else 0.0
+        rows.append((name, old, new, change, change > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compare two sets of benchmark results.'
+    )
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='fractional slowdown counted as a regression '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    with open(args.before) as before_file:
+        before = json.load(before_file)
+    with open(args.after) as after_file:
+        after = json.load(after_file)
+
+    for key in ('version', 'scale', 'libwaveplot', 'full_bytes'):
+        if before.get(key) != after.get(key):
+            sys.stderr.write('Warning: {} differs ({!r} and {!r})\n'.format(
+                key, before.get(key), after.get(key)
+            ))
+
+    regressed = False
+    for name, old, new, change, slower in compare(before, after,
+                                                  args.threshold):
+        sys.stdout.write('{:<28} {:>10.3f} ms {:>10.3f} ms {:>+8.1%}{}\n'
+                         .format(name, old * 1000.0, new * 1000.0, change,
+                                 '  REGRESSED' if slower else ''))
+        regressed = regressed or slower
+
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Benchmarks of the canonical queries against a database seeded by
+benchmarks.seed. Each benchmark takes a Session, the seeded Scale and an
+iteration number, which is used to pick a different entity each time.
+"""
+
+from wpschema.browse import WavePlotContextSummary
+from wpschema.musicbrainz import Release
+from wpschema.redirects import GIDResolver
+from wpschema.waveplot import Edit, WavePlotContext
+
+from benchmarks.seed import gid
+
+EDITS_PER_PAGE = 50
+REDIRECT_BATCH_SIZE = 100
+
+# A prime stride, so that successive iterations query rows spread across
+# each table rather than neighbouring rows.
+_STRIDE = 7919
+
+
+def _number(i, count):
+    return i * _STRIDE % count + 1
+
+
+def browse_release(session, scale, i):
+    """The WavePlots of a release's tracklist, from the context summary."""
+
+    release_gid = gid('release', _number(i, scale.releases))
+
+    return session.query(WavePlotContextSummary).filter(
+        WavePlotContextSummary.release_gid == release_gid
+    ).order_by(
+        WavePlotContextSummary.medium_position,
+        WavePlotContextSummary.track_position
+    ).all()
+
+
+def waveplot_contexts(session, scale, i):
+    """The contexts a WavePlot is linked to."""
+
+    waveplot_gid = gid('waveplot', _number(i, scale.waveplots))
+
+    return session.query(WavePlotContext).filter(
+        WavePlotContext.waveplot_gid == waveplot_gid
+    ).all()
+
+
+def editor_edits(session, scale, i):
+    """The latest page of an editor's edits."""
+
+    return session.query(Edit).filter(
+        Edit.editor_id == _number(i, scale.editors)
+    ).order_by(Edit.time.desc()).limit(EDITS_PER_PAGE).all()
+
+
+def resolve_redirects(session, scale, i):
+    """Resolves a batch of release gids, a tenth of which are redirects,
+    without the resolver's cache.
+    """
+
+    redirected = list(scale.redirected(scale.releases))
+
+    gids = []
+    for offset in range(REDIRECT_BATCH_SIZE):
+        number = _number(i * REDIRECT_BATCH_SIZE + offset, scale.releases)
+        if offset % 10 == 0 and redirected:
+            number = redirected[number % len(redirected)]
+            gids.append(gid('release_redirect', number))
+        else:
+            gids.append(gid('release', number))
+
+    return GIDResolver(cache_size=0).resolve(session, Release, gids)
+
+
+QUERIES = [
+    ('browse_release', browse_release),
+    ('waveplot_contexts', waveplot_contexts),
+    ('editor_edits', editor_edits),
+    ('resolve_redirects', resolve_redirects),
+]
@@ -0,0 +1,158 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Runs the benchmarks and writes their results as JSON.
+
+    python -m benchmarks.run --seed --scale 1000000 --output results.json
+
+The database benchmarks need a PostgreSQL database which may be emptied
+and seeded; use --skip-database to run only the client benchmarks.
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import sys
+
+import numpy
+import sqlalchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from benchmarks import client, queries, seed
+from benchmarks.timing import DEFAULT_ITERATIONS, DEFAULT_WARMUP, measure
+
+DEFAULT_DATABASE = 'postgresql:///waveplot_bench'
+
+# Increase when the benchmarks change in a way that makes results
+# incomparable with earlier ones.
+RESULTS_VERSION = 1
+
+
+def _log(message):
+    sys.stderr.write(message + '\n')
+
+
+def run_queries(engine, scale, iterations, warmup):
+    """Returns a dict of query benchmark names to timing summaries."""
+
+    results = {}
+    session = Session(engine)
+    try:
+        for name, query in queries.QUERIES:
+            _log('Timing query {}'.format(name))
+            results['query.' + name] = measure(
+                lambda i: query(session, scale, i), iterations, warmup,
+                teardown=session.expunge_all
+            )
+    finally:
+        session.close()
+
+    return results
+
+
+def run_client(full_bytes, iterations, warmup):
+    """Returns the library used, and a dict of client benchmark names to
+    timing summaries.
+    """
+
+    lib = client.load_lib()
+    waveplot = client.synthetic_waveplot(full_bytes)
+
+    results = {}
+    for name, benchmark in client.benchmarks(waveplot):
+        _log('Timing client {}'.format(name))
+        results['client.' + name] = measure(benchmark, iterations, warmup)
+
+    return lib, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the wpschema queries and client.'
+    )
+    parser.add_argument('--database', default=DEFAULT_DATABASE,
+                        help='SQLAlchemy URL of the benchmark database '
+                             '(default: %(default)s)')
+    parser.add_argument('--scale', type=int, default=seed.DEFAULT_SCALE,
+                        help='number of WavePlotContexts seeded '
+                             '(default: %(default)s)')
+    parser.add_argument('--seed', action='store_true',
+                        help='drop, recreate and seed the database first')
+    parser.add_argument('--batch-size', type=int,
+                        default=seed.DEFAULT_BATCH_SIZE,
+                        help='rows inserted per seeding transaction')
+    parser.add_argument('--full-bytes', type=int,
+                        default=client.DEFAULT_FULL_BYTES,
+                        help='length of the full waveforms benchmarked')
+    parser.add_argument('--seed-full-bytes', type=int,
+                        default=seed.DEFAULT_FULL_BYTES,
+                        help='length of the full waveforms seeded')
+    parser.add_argument('-n', '--iterations', type=int,
+                        default=DEFAULT_ITERATIONS)
+    parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP)
+    parser.add_argument('--skip-database', action='store_true')
+    parser.add_argument('--skip-client', action='store_true')
+    parser.add_argument('-o', '--output', default=None,
+                        help='file to write results to (default: stdout)')
+    args = parser.parse_args(argv)
+
+    results = {
+        'version': RESULTS_VERSION,
+        'created': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'numpy': numpy.__version__,
+        'iterations': args.iterations,
+        'benchmarks': {},
+    }
+
+    if not args.skip_database:
+        engine = create_engine(args.database)
+        if args.seed:
+            seed.create(engine, reset=True)
+            seed.seed(engine, args.scale, args.batch_size,
+                      args.seed_full_bytes, log=_log)
+
+        results['scale'] = args.scale
+        results['benchmarks'].update(run_queries(
+            engine, seed.Scale(args.scale), args.iterations, args.warmup
+        ))
+        engine.dispose()
+
+    if not args.skip_client:
+        lib, client_results = run_client(args.full_bytes, args.iterations,
+                                         args.warmup)
+        results['libwaveplot'] = lib
+        results['full_bytes'] = args.full_bytes
+        results['benchmarks'].update(client_results)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output is None:
+        sys.stdout.write(output + '\n')
+    else:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,297 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Seeds a database with synthetic musicbrainz and waveplot data for the
+benchmarks.
+
+The amount of data is set by the number of WavePlotContexts, from around
+10,000 up to 10,000,000. Every other table is sized in proportion to that,
+and rows are generated by the database itself in batches, so that seeding
+a large database doesn't involve sending every row from Python. Identifiers
+are derived from row numbers (see gid), so the benchmarks can pick entities
+to query without reading them back first.
+"""
+
+import datetime
+import hashlib
+import uuid
+
+from sqlalchemy.sql import text as sql_text
+
+from wpschema.base import Base
+from wpschema.browse import refresh_context_summary
+from wpschema.bulk import LINK_EDIT_TYPE, UPLOAD_EDIT_TYPE
+from wpschema.migrate import prepare_summary_refresh
+from wpschema.partition import create_edit_partition
+
+DEFAULT_SCALE = 10000
+DEFAULT_BATCH_SIZE = 100000
+DEFAULT_FULL_BYTES = 1024
+
+TRACKS_PER_RELEASE = 10
+CONTEXTS_PER_WAVEPLOT = 2
+CONTEXTS_PER_ARTIST_CREDIT = 100
+EDITORS = 100
+
+# Edits are spread over this many days before the seeding time.
+EDIT_DAYS = 730
+
+# One in this many releases, recordings and tracks also has a redirect gid.
+REDIRECT_INTERVAL = 100
+
+
+def gid(kind, number):
+    """Returns the gid the seeded database uses for row number of kind, for
+    example gid('release', 1). Matches md5(kind || number)::uuid in SQL.
+    """
+
+    digest = hashlib.md5('{}{}'.format(kind, number).encode('utf-8'))
+    return uuid.UUID(digest.hexdigest())
+
+
+def _ceil_div(count, size):
+    return max(1, (count + size - 1) // size)
+
+
+class Scale(object):
+    """The number of rows of each kind seeded for a number of contexts."""
+
+    def __init__(self, contexts):
+        self.contexts = contexts
+        self.tracks = contexts
+        self.recordings = contexts
+        self.releases = _ceil_div(contexts, TRACKS_PER_RELEASE)
+        self.artist_credits = max(1, contexts // CONTEXTS_PER_ARTIST_CREDIT)
+        self.waveplots = _ceil_div(contexts, CONTEXTS_PER_WAVEPLOT)
+        self.editors = EDITORS
+
+    def redirected(self, count):
+        """Returns the row numbers of count rows which have redirects."""
+        return range(REDIRECT_INTERVAL, count + 1, REDIRECT_INTERVAL)
+
+
+# Each statement inserts rows :start to :stop - 1 of one table, and is run
+# in batches over the number of rows given by the attribute of Scale.
+_SEED_STATEMENTS = [
+    ('editors', """
+        INSERT INTO waveplot.editor (id, name, email, key, query_rate, active)
+        SELECT i, 'Editor ' || i, 'editor' || i || '@example.com',
+               lpad(to_hex(i), 6, '0'), 60, true
+        FROM generate_series(:start, :stop - 1) AS i
+    """),
+    ('artist_credits', """
+        INSERT INTO musicbrainz.artist_credit
+            (id, name, artist_count, ref_count, created, last_updated)
+        SELECT i, 'Artist ' || i, 1, 0, now(), now()
+        FROM generate_series(:start, :stop - 1) AS i
+    """),
+    ('releases', """
+        INSERT INTO musicbrainz.release_group
+            (id, gid, name, artist_credit, comment, edits_pending,
+             last_updated)
+        SELECT i, md5('release_group' || i)::uuid, 'Release ' || i,
+               (i - 1) % :artist_credits + 1, '', 0, now()
+        FROM generate_series(:start, :stop - 1) AS i
+    """),
+    ('releases', """
+        INSERT INTO musicbrainz.release
+            (id, gid, name, artist_credit, release_group, comment,
+             edits_pending, quality, last_updated)
+        SELECT i, md5('release' || i)::uuid, 'Release ' || i,
+               (i - 1) % :artist_credits + 1, i, '', 0, -1, now()
+        FROM generate_series(:start, :stop - 1) AS i
+    """),
+    ('releases', """
+        INSERT INTO musicbrainz.medium
+            (id, release, position, edits_pending, last_updated, track_count)
+        SELECT i, i, 1, 0, now(), :tracks_per_release
+        FROM generate_series(:start, :stop - 1) AS i
+    """),
+    ('recordings', """
+        INSERT INTO musicbrainz.recording
+            (id, gid, name, artist_credit, length, comment, edits_pending,
+             last_updated, video)
+        SELECT i, md5('recording' || i)::uuid, 'Recording ' || i,
+               (i - 1) % :artist_credits + 1, 120000 + i % 480 * 1000, '', 0,
+               now(), false
+        FROM generate_series(:start, :stop - 1) AS i
+    """),
+    ('tracks', """
+        INSERT INTO musicbrainz.track
+            (id, gid, recording, medium, position, number, name,
+             artist_credit, length, edits_pending, last_updated)
+        SELECT i, md5('track' || i)::uuid, i,
+               (i - 1) / :tracks_per_release + 1,
+               (i - 1) % :tracks_per_release + 1,
+               ((i - 1) % :tracks_per_release + 1)::text, 'Track ' || i,
+               (i - 1) % :artist_credits + 1, 120000 + i % 480 * 1000, 0,
+               now()
+        FROM generate_series(:start, :stop - 1) AS i
+    """),
+    ('waveplots', """
+        INSERT INTO waveplot.waveplot
+            (gid, duration, source_type, sample_rate, bit_depth, bit_rate,
+             num_channels, dr_level, image_hash, preview, thumbnail,
+             sonic_hash, version)
+        SELECT md5('waveplot' || i)::uuid,
+               (120 + i % 480) * interval '1 second', 'FLAC', 44100, 16,
+               1411200, 2, i % 20, decode(md5('image' || i), 'hex'),
+               decode(repeat(md5('preview' || i), 25), 'hex'),
+               substring(decode(repeat(md5('thumbnail' || i), 4), 'hex')
+                         from 1 for 50),
+               i::bigint * 2654435761 % 65536,
+               'DAMSON'::waveplot.waveplot_version
+        FROM generate_series(:start, :stop - 1) AS i
+    """),
+    ('waveplots', """
+        INSERT INTO waveplot.waveplot_data (gid, "full")
+        SELECT md5('waveplot' || i)::uuid,
+               substring(decode(repeat(md5('full' || i), :full_repeats),
+                                'hex') from 1 for :full_bytes)
+        FROM generate_series(:start, :stop - 1) AS i
+    """),
+    ('waveplots', """
+        INSERT INTO waveplot.edit (type, time, editor_id, waveplot_gid)
+        SELECT :upload_edit_type,
+               (now() at time zone 'utc') - i % :edit_days * interval '1 day',
+               (i - 1) % :editors + 1, md5('waveplot' || i)::uuid
+        FROM generate_series(:start, :stop - 1) AS i
+    """),
+    ('contexts', """
+        INSERT INTO waveplot.waveplot_context
+            (waveplot_gid, release_gid, recording_gid, track_gid,
+             artist_credit_id)
+        SELECT md5('waveplot' || ((i - 1) / :contexts_per_waveplot + 1))::uuid,
+               md5('release' || ((i - 1) / :tracks_per_release + 1))::uuid,
+               md5('recording' || i)::uuid, md5('track' || i)::uuid,
+               (i - 1) % :artist_credits + 1
+        FROM generate_series(:start, :stop - 1) AS i
+    """),
+    ('contexts', """
+        INSERT INTO waveplot.edit (type, time, editor_id, waveplot_gid)
+        SELECT :link_edit_type,
+               (now() at time zone 'utc') - i % :edit_days * interval '1 day',
+               (i - 1) % :editors + 1,
+               md5('waveplot' || ((i - 1) / :contexts_per_waveplot + 1))::uuid
+        FROM generate_series(:start, :stop - 1) AS i
+    """),
+]
+
+# Redirects point from gid(kind + '_redirect', n) to row n, for every row
+# number n returned by Scale.redirected.
+_REDIRECT_TABLES = [
+    ('releases', 'release'),
+    ('recordings', 'recording'),
+    ('tracks', 'track'),
+]
+
+
+def _batches(count, batch_size):
+    for start in range(1, count + 1, batch_size):
+        yield start, min(start + batch_size, count + 1)
+
+
+def create(engine, reset=False):
+    """Creates the musicbrainz and waveplot schemas and their tables,
+    dropping any existing tables first if reset is True.
+    """
+
+    with engine.begin() as connection:
+        for schema in ('musicbrainz', 'waveplot'):
+            connection.execute(sql_text(
+                'CREATE SCHEMA IF NOT EXISTS {}'.format(schema)
+            ))
+
+    if reset:
+        Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    prepare_summary_refresh(engine)
+
+
+def _create_edit_partitions(connection, days):
+    # Monthly partitions for every seeded edit, so that they don't all go to
+    # the default partition and the benchmarks see partition pruning.
+    today = datetime.datetime.utcnow().date()
+    first = today - datetime.timedelta(days=days)
+
+    month = datetime.date(first.year, first.month, 1)
+    while month <= today:
+        create_edit_partition(connection, month)
+        month = (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def seed(engine, contexts=DEFAULT_SCALE, batch_size=DEFAULT_BATCH_SIZE,
+         full_bytes=DEFAULT_FULL_BYTES, log=None):
+    """Fills the tables created by create with synthetic data for the given
+    number of contexts, then builds the context summary and analyzes the
+    tables. Each batch is committed separately. If log is provided, it is
+    called with a message as each table is seeded.
+    """
+
+    scale = Scale(contexts)
+    parameters = {
+        'artist_credits': scale.artist_credits,
+        'editors': scale.editors,
+        'tracks_per_release': TRACKS_PER_RELEASE,
+        'contexts_per_waveplot': CONTEXTS_PER_WAVEPLOT,
+        'full_bytes': full_bytes,
+        'full_repeats': full_bytes // 16 + 1,
+        'upload_edit_type': UPLOAD_EDIT_TYPE,
+        'link_edit_type': LINK_EDIT_TYPE,
+        'edit_days': EDIT_DAYS,
+    }
+
+    with engine.begin() as connection:
+        _create_edit_partitions(connection, EDIT_DAYS)
+
+    for attribute, statement in _SEED_STATEMENTS:
+        count = getattr(scale, attribute)
+        if log is not None:
+            log('Seeding {} ({} rows)'.format(statement.split()[2], count))
+
+        for start, stop in _batches(count, batch_size):
+            with engine.begin() as connection:
+                connection.execute(sql_text(statement), dict(
+                    parameters, start=start, stop=stop
+                ))
+
+    with engine.begin() as connection:
+        for attribute, kind in _REDIRECT_TABLES:
+            rows = [
+                {'gid': gid(kind + '_redirect', number), 'new_id': number}
+                for number in scale.redirected(getattr(scale, attribute))
+            ]
+            if rows:
+                table = Base.metadata.tables[
+                    'musicbrainz.{}_gid_redirect'.format(kind)
+                ]
+                connection.execute(table.insert(), rows)
+
+    if log is not None:
+        log('Building the context summary')
+    with engine.begin() as connection:
+        refresh_context_summary(connection)
+
+    # ANALYZE can't run inside a transaction block.
+    with engine.connect() as connection:
+        connection = connection.execution_options(
+            isolation_level='AUTOCOMMIT'
+        )
+        connection.execute(sql_text('ANALYZE'))
+
+    return scale
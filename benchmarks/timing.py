@@ -0,0 +1,65 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Times repeated calls of a benchmark function."""
+
+import timeit
+
+DEFAULT_ITERATIONS = 100
+DEFAULT_WARMUP = 5
+
+
+def _percentile(ordered, fraction):
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(times):
+    """Returns a dict of statistics, in seconds, of a list of run times."""
+
+    ordered = sorted(times)
+    return {
+        'iterations': len(ordered),
+        'min': ordered[0],
+        'mean': sum(ordered) / len(ordered),
+        'median': _percentile(ordered, 0.5),
+        'p95': _percentile(ordered, 0.95),
+        'max': ordered[-1],
+    }
+
+
+def measure(function, iterations=DEFAULT_ITERATIONS, warmup=DEFAULT_WARMUP,
+            teardown=None):
+    """Calls function(i) warmup times untimed, then iterations times timed,
+    and returns a summary of the timed calls. If teardown is provided, it is
+    called untimed after each call, for example to clear a Session.
+    """
+
+    times = []
+    for i in range(warmup + iterations):
+        start = timeit.default_timer()
+        function(i)
+        elapsed = timeit.default_timer() - start
+
+        if i >= warmup:
+            times.append(elapsed)
+
+        if teardown is not None:
+            teardown()
+
+    return summarize(times)
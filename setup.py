@@ -9,6 +9,6 @@ setup(name='wpschema',
       author_email='ben.sput@gmail.com',
       url='https://github.com/waveplot/schema',
       packages=['wpschema'],
-      requires=['sqlalchemy (>=0.9.7)', 'psycopg2 (>=2.5.4)'],
+      requires=['sqlalchemy (>=1.4)', 'psycopg2 (>=2.5.4)', 'numpy'],
       provides=['wpschema'],
 )
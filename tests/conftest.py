@@ -0,0 +1,145 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Fixtures shared by the tests, including an in-memory SQLite database
+with the musicbrainz schema, for tests which don't need PostgreSQL, and a
+stub WavePlot server for the clients.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects.postgresql import BYTEA, UUID
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+
+from wpschema.base import Base
+
+
+@compiles(UUID, 'sqlite')
+def _compile_uuid(type_, compiler, **kw):
+    return 'CHAR(36)'
+
+
+@compiles(BYTEA, 'sqlite')
+def _compile_bytea(type_, compiler, **kw):
+    return 'BLOB'
+
+
+@pytest.fixture
+def sqlite_engine():
+    """An engine for an in-memory SQLite database with the musicbrainz and
+    waveplot schemas attached, and the musicbrainz tables created.
+    """
+
+    import wpschema  # noqa: F401 - registers all models with Base
+
+    engine = create_engine('sqlite://')
+
+    @event.listens_for(engine, 'connect')
+    def attach(dbapi_connection, connection_record):
+        for schema in ('musicbrainz', 'waveplot'):
+            dbapi_connection.execute(
+                "ATTACH DATABASE ':memory:' AS {}".format(schema)
+            )
+
+    Base.metadata.create_all(engine, tables=[
+        table for table in Base.metadata.sorted_tables
+        if table.schema == 'musicbrainz'
+    ])
+
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def sqlite_session(sqlite_engine):
+    session = Session(bind=sqlite_engine)
+    yield session
+    session.close()
+
+
+class StubServer(object):
+    """A local HTTP server answering each (method, path) with a canned
+    response, and recording the requests it receives.
+    """
+
+    def __init__(self):
+        self.responses = {}
+        self.requests = []
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _respond(self):
+                length = int(self.headers.get('content-length', 0))
+                body = self.rfile.read(length)
+                stub.requests.append(
+                    (self.command, self.path, self.headers, body)
+                )
+
+                status, content_type, body = stub.responses.get(
+                    (self.command, self.path),
+                    (404, 'application/json', b'{"message": "Not found"}')
+                )
+                self.send_response(status)
+                self.send_header('content-type', content_type)
+                self.send_header('content-length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = _respond
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def respond(self, method, path, status=200, body=None,
+                content_type='application/json'):
+        """Sets the response to method requests for path. A body which isn't
+        bytes is sent as JSON.
+        """
+
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.responses[(method, path)] = (status, content_type, body)
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': 0.01})
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    server.start()
+    yield server
+    server.stop()
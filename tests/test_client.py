@@ -0,0 +1,171 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests the blocking WavePlot client against a stub server."""
+
+import base64
+import json
+import uuid
+import zlib
+
+import pytest
+
+from wpschema import _waveplot
+from wpschema._waveplot import (BINARY_CONTENT_TYPE, COMPRESSION_ZLIB,
+                                COMPRESSION_ZSTD, Client, WavePlot,
+                                pack_waveplot, unpack_waveplot)
+
+GID = str(uuid.UUID(int=1))
+FULL = bytes(bytearray(range(200))) * 5
+
+METADATA = {
+    'gid': GID, 'duration': 300, 'dr_level': 10, 'source_type': 'FLAC',
+    'sample_rate': 44100, 'bit_depth': 16, 'bit_rate': 1411200,
+    'num_channels': 2, 'image_sha1': 'ab' * 20, 'thumbnail': 'thumbnail',
+    'sonic_hash': 1234, 'version': 'DAMSON',
+}
+
+
+@pytest.fixture
+def client(stub_server):
+    with Client(stub_server.url, retries=0) as client:
+        yield client
+
+
+def _generated_waveplot():
+    # As left by Generator, with ctypes strings as bytes.
+    waveplot = WavePlot()
+    waveplot.full = FULL
+    waveplot.duration = 300
+    waveplot.dr_level = 10
+    waveplot.source_type = b'FLAC'
+    waveplot.sample_rate = 44100
+    waveplot.bit_depth = 16
+    waveplot.bit_rate = 1411200
+    waveplot.num_channels = 2
+    waveplot.version = b'DAMSON'
+    return waveplot
+
+
+def test_get_json(stub_server, client):
+    path = '/api/waveplot/' + GID
+    stub_server.respond('GET', path, body=METADATA)
+    stub_server.respond('GET', path + '/full', body={
+        'data': base64.b64encode(FULL).decode('ascii')
+    })
+
+    waveplot = WavePlot()
+    waveplot.get(GID, client)
+
+    assert waveplot.gid == GID
+    assert waveplot.version == 'DAMSON'
+    assert waveplot.full == FULL
+
+
+def test_get_binary(stub_server, client):
+    path = '/api/waveplot/' + GID
+    stub_server.respond('GET', path, body=METADATA)
+    stub_server.respond('GET', path + '/full',
+                        body=pack_waveplot({}, FULL, COMPRESSION_ZLIB),
+                        content_type=BINARY_CONTENT_TYPE)
+
+    waveplot = WavePlot()
+    waveplot.get(GID, client)
+
+    assert waveplot.full == FULL
+    accept = [headers['accept'] for method, path, headers, body
+              in stub_server.requests if path.endswith('/full')]
+    assert accept[0].startswith(BINARY_CONTENT_TYPE)
+
+
+def test_upload_json(stub_server, client):
+    stub_server.respond('POST', '/api/waveplot', body={
+        'gid': GID, 'image_hash': 'ab' * 20, 'thumbnail': 'thumbnail',
+        'sonic_hash': 1234
+    })
+
+    waveplot = _generated_waveplot()
+    waveplot.upload('editor', client)
+
+    assert waveplot.gid == GID
+    assert waveplot.sonic_hash == 1234
+
+    _, _, _, body = stub_server.requests[-1]
+    data = json.loads(body.decode('utf-8'))
+    assert data['source_type'] == 'FLAC'
+    assert data['version'] == 'DAMSON'
+    assert zlib.decompress(base64.b64decode(data['image'])) == FULL
+
+
+def test_upload_binary(stub_server, client):
+    stub_server.respond('POST', '/api/waveplot', body={
+        'gid': GID, 'image_hash': 'ab' * 20, 'thumbnail': 'thumbnail',
+        'sonic_hash': 1234
+    })
+
+    client.binary = True
+    waveplot = _generated_waveplot()
+    waveplot.upload('editor', client)
+
+    assert waveplot.gid == GID
+
+    _, _, headers, body = stub_server.requests[-1]
+    assert headers['content-type'] == BINARY_CONTENT_TYPE
+    metadata, full = unpack_waveplot(body)
+    assert metadata['version'] == 'DAMSON'
+    assert full == FULL
+
+
+def test_upload_existing(stub_server, client):
+    stub_server.respond('POST', '/api/waveplot', status=303,
+                        body={'message': GID})
+
+    waveplot = _generated_waveplot()
+    waveplot.upload('editor', client)
+
+    assert waveplot.gid == GID
+
+
+def test_link(stub_server, client):
+    stub_server.respond('POST', '/api/waveplot_context', body={})
+
+    waveplot = _generated_waveplot()
+    waveplot.gid = GID
+    waveplot.link({'track_mbid': str(uuid.UUID(int=2))}, client)
+
+    _, _, _, body = stub_server.requests[-1]
+    assert json.loads(body.decode('utf-8'))['waveplot_uuid'] == GID
+
+
+@pytest.mark.parametrize('status', [200, 303])
+def test_upload_not_json(stub_server, client, capsys, status):
+    stub_server.respond('POST', '/api/waveplot', status=status,
+                        body=b'<html></html>', content_type='text/html')
+
+    waveplot = _generated_waveplot()
+    waveplot.upload('editor', client)
+
+    assert waveplot.gid is None
+    assert "doesn't contain a result" in capsys.readouterr().out
+
+
+def test_pack_zstd_without_zstandard(monkeypatch):
+    monkeypatch.setattr(_waveplot, 'zstandard', None)
+
+    with pytest.raises(ValueError):
+        pack_waveplot({}, FULL, COMPRESSION_ZSTD)
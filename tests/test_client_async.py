@@ -0,0 +1,159 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests the asyncio WavePlot client against a mock aiohttp server."""
+
+import asyncio
+import base64
+import json
+import uuid
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from aiohttp import web  # noqa: E402
+from aiohttp import test_utils  # noqa: E402
+
+from wpschema._waveplot import (BINARY_CONTENT_TYPE,  # noqa: E402
+                                COMPRESSION_ZLIB, WavePlot, pack_waveplot)
+from wpschema._waveplot_async import AsyncClient, TokenBucket  # noqa: E402
+
+GID = str(uuid.UUID(int=1))
+FULL = bytes(bytearray(range(200))) * 5
+
+METADATA = {
+    'gid': GID, 'duration': 300, 'dr_level': 10, 'source_type': 'FLAC',
+    'sample_rate': 44100, 'bit_depth': 16, 'bit_rate': 1411200,
+    'num_channels': 2, 'image_sha1': 'ab' * 20, 'thumbnail': 'thumbnail',
+    'sonic_hash': 1234, 'version': 'DAMSON',
+}
+
+
+def _run(routes, test):
+    """Runs test(client, requests) against a server with the given routes,
+    which are (method, path, handler) tuples.
+    """
+
+    requests = []
+
+    @web.middleware
+    async def record(request, handler):
+        requests.append((request.method, request.path, request.headers,
+                         await request.read()))
+        return await handler(request)
+
+    async def main():
+        app = web.Application(middlewares=[record])
+        for method, path, handler in routes:
+            app.router.add_route(method, path, handler)
+
+        async with test_utils.TestServer(app) as server:
+            url = str(server.make_url('')).rstrip('/')
+            async with AsyncClient(url, concurrency=4) as client:
+                await test(client, requests)
+
+    asyncio.run(main())
+
+
+def _waveplot():
+    waveplot = WavePlot()
+    waveplot.full = FULL
+    waveplot.duration = 300
+    waveplot.dr_level = 10
+    waveplot.source_type = b'FLAC'
+    waveplot.sample_rate = 44100
+    waveplot.bit_depth = 16
+    waveplot.bit_rate = 1411200
+    waveplot.num_channels = 2
+    waveplot.version = b'DAMSON'
+    return waveplot
+
+
+async def _metadata(request):
+    return web.json_response(METADATA)
+
+
+def test_get_json():
+    async def full(request):
+        return web.json_response({
+            'data': base64.b64encode(FULL).decode('ascii')
+        })
+
+    async def test(client, requests):
+        waveplot = await client.get(WavePlot(), GID)
+        assert waveplot.gid == GID
+        assert waveplot.full == FULL
+
+    path = '/api/waveplot/' + GID
+    _run([('GET', path, _metadata), ('GET', path + '/full', full)], test)
+
+
+def test_get_binary():
+    async def full(request):
+        return web.Response(body=pack_waveplot({}, FULL, COMPRESSION_ZLIB),
+                            content_type=BINARY_CONTENT_TYPE)
+
+    async def test(client, requests):
+        waveplot = await client.get(WavePlot(), GID)
+        assert waveplot.full == FULL
+
+        accept = [headers['accept'] for method, path, headers, body
+                  in requests if path.endswith('/full')]
+        assert accept[0].startswith(BINARY_CONTENT_TYPE)
+
+    path = '/api/waveplot/' + GID
+    _run([('GET', path, _metadata), ('GET', path + '/full', full)], test)
+
+
+def test_upload_all():
+    async def upload(request):
+        data = await request.json()
+        assert data['version'] == 'DAMSON'
+        return web.json_response({
+            'gid': GID, 'image_hash': 'ab' * 20, 'thumbnail': 'thumbnail',
+            'sonic_hash': 1234
+        })
+
+    async def test(client, requests):
+        waveplots = await client.upload_all([_waveplot() for _ in range(10)],
+                                            'editor')
+        assert [waveplot.gid for waveplot in waveplots] == [GID] * 10
+        assert len(requests) == 10
+
+    _run([('POST', '/api/waveplot', upload)], test)
+
+
+def test_link_empty_body():
+    async def link(request):
+        return web.Response(status=500)
+
+    async def test(client, requests):
+        waveplot = _waveplot()
+        waveplot.gid = GID
+        assert await client.link_all([(waveplot, {})]) == [False]
+
+        _, _, _, body = requests[0]
+        assert json.loads(body.decode('utf-8'))['waveplot_uuid'] == GID
+
+    _run([('POST', '/api/waveplot_context', link)], test)
+
+
+def test_token_bucket_rejects_zero_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(0)
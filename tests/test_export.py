@@ -0,0 +1,76 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Checks that npy exports bound chunks of WavePlots by size, and refuse to
+truncate text values.
+"""
+
+import datetime
+import uuid
+
+import pytest
+
+from wpschema import export
+from wpschema.waveplot import WavePlot, WavePlotData
+
+FULL_BYTES = 1000
+
+
+@pytest.fixture
+def engine(sqlite_engine):
+    WavePlot.metadata.create_all(sqlite_engine, tables=[
+        WavePlot.__table__, WavePlotData.__table__
+    ])
+    return sqlite_engine
+
+
+def _insert(engine, count, source_type=u'mp3'):
+    with engine.begin() as connection:
+        for number in range(1, count + 1):
+            gid = uuid.UUID(int=number)
+            connection.execute(WavePlot.__table__.insert(), {
+                'gid': gid, 'duration': datetime.timedelta(seconds=number),
+                'source_type': source_type, 'num_channels': 2,
+                'dr_level': 10, 'image_hash': gid.bytes, 'preview': b'',
+                'thumbnail': b'', 'sonic_hash': number, 'version': u'DAMSON'
+            })
+            connection.execute(WavePlotData.__table__.insert(), {
+                'gid': gid, 'full': bytes(bytearray([number])) * FULL_BYTES
+            })
+
+
+def test_chunk_bytes(engine, tmpdir):
+    _insert(engine, 10)
+
+    manifest = export.export(engine, str(tmpdir), contexts=False,
+                             chunk_bytes=3 * FULL_BYTES)
+    assert [chunk['rows'] for chunk in manifest['tables']['waveplot']] == \
+        [3, 3, 3, 1]
+
+    chunks = list(export.waveplot_chunks(str(tmpdir)))
+    assert bytes(chunks[1].full(0)) == b'\x04' * FULL_BYTES
+    assert chunks[3].records[0]['source_type'] == b'mp3'
+    assert chunks[3].records[0]['version'] == b'DAMSON'
+
+
+def test_source_type_too_long(engine, tmpdir):
+    # Each character takes two bytes in UTF-8.
+    _insert(engine, 1, source_type=u'\xe9' * 20)
+
+    with pytest.raises(ValueError):
+        export.export(engine, str(tmpdir), contexts=False)
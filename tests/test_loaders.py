@@ -0,0 +1,136 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Checks that each loader preset loads everything its page displays within
+a fixed number of statements.
+"""
+
+import uuid
+
+import pytest
+from sqlalchemy import event
+
+from wpschema import loaders
+from wpschema.musicbrainz import (Area, AreaType, Artist, ArtistCredit,
+                                  ArtistType, Gender, Language, Medium,
+                                  Recording, Release, ReleaseGroup,
+                                  ReleaseGroupPrimaryType, ReleasePackaging,
+                                  ReleaseStatus, Script, Track)
+
+RELEASE_GID = uuid.UUID(int=1)
+TRACK_GID = uuid.UUID(int=2)
+ARTIST_GID = uuid.UUID(int=3)
+
+# The most statements each preset may use, including accessing everything
+# it loads.
+CEILINGS = {
+    'release': 3,
+    'track': 1,
+    'artist': 1,
+}
+
+
+@pytest.fixture
+def session(sqlite_session):
+    credit = ArtistCredit(name=u'Artist', artist_count=1)
+    release_group = ReleaseGroup(
+        gid=uuid.uuid4(), name=u'Album', artist_credit=credit,
+        type=ReleaseGroupPrimaryType(name=u'Album')
+    )
+    release = Release(
+        gid=RELEASE_GID, name=u'Album', artist_credit=credit,
+        release_group=release_group, status=ReleaseStatus(name=u'Official'),
+        packaging=ReleasePackaging(name=u'Jewel Case'),
+        language=Language(name=u'English'),
+        script=Script(iso_code=u'Latn', iso_number=u'215', name=u'Latin')
+    )
+
+    for position in (1, 2):
+        medium = Medium(release=release, position=position)
+        for number in (1, 2):
+            recording = Recording(gid=uuid.uuid4(), name=u'Song',
+                                  artist_credit=credit)
+            medium.tracks.append(Track(
+                gid=TRACK_GID if (position, number) == (1, 1) else
+                uuid.uuid4(), recording=recording, position=number,
+                number=str(number), name=u'Song', artist_credit=credit
+            ))
+
+    area = Area(gid=uuid.uuid4(), name=u'Area', type=AreaType(name=u'City'))
+    artist = Artist(
+        gid=ARTIST_GID, name=u'Artist', sort_name=u'Artist',
+        type=ArtistType(name=u'Person'), gender=Gender(name=u'Other'),
+        area=area, begin_area=area, end_area=area
+    )
+
+    sqlite_session.add_all([release, artist])
+    sqlite_session.commit()
+    sqlite_session.expunge_all()
+
+    return sqlite_session
+
+
+def _display_release(release):
+    release.artist_credit.name
+    release.release_group.type.name
+    release.status.name
+    release.packaging.name
+    release.language.name
+    release.script.name
+    for medium in release.media:
+        for track in medium.tracks:
+            track.recording.name
+            track.artist_credit.name
+
+
+def _display_track(track):
+    track.artist_credit.name
+    track.recording.artist_credit.name
+    track.medium.release.artist_credit.name
+    track.medium.release.release_group.name
+
+
+def _display_artist(artist):
+    artist.type.name
+    artist.gender.name
+    artist.area.type.name
+    artist.begin_area.name
+    artist.end_area.name
+
+
+@pytest.mark.parametrize('preset, gid, display', [
+    ('release', RELEASE_GID, _display_release),
+    ('track', TRACK_GID, _display_track),
+    ('artist', ARTIST_GID, _display_artist),
+])
+def test_statement_count(session, preset, gid, display):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        entity = loaders.get_by_gid(session, preset, gid)
+        display(entity)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+    assert entity is not None
+    assert len(statements) <= CEILINGS[preset], '\n\n'.join(statements)
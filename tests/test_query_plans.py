@@ -0,0 +1,110 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Checks that the canonical access paths are planned using the indexes
+added for them. These tests need a PostgreSQL database without the
+musicbrainz and waveplot schemas, given by the WPSCHEMA_TEST_DATABASE
+environment variable; the schema is created in a transaction which is
+rolled back afterwards.
+"""
+
+import os
+import uuid
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text as sql_text
+
+from wpschema.base import Base
+from wpschema.waveplot import Edit, WavePlotContext
+
+DATABASE_URL = os.environ.get('WPSCHEMA_TEST_DATABASE')
+
+pytestmark = pytest.mark.skipif(DATABASE_URL is None,
+                                reason='WPSCHEMA_TEST_DATABASE is not set')
+
+# The indexes on the partitions of a partitioned table are attached to the
+# index on the table itself.
+_INDEX_NAMES = sql_text("""
+    SELECT child.relname FROM pg_inherits
+    JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = to_regclass(:name)
+    UNION SELECT :index
+""")
+
+
+@pytest.fixture(scope='module')
+def connection():
+    import wpschema  # noqa: F401 - registers all models with Base
+
+    engine = create_engine(DATABASE_URL)
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        connection.execute(sql_text("CREATE SCHEMA musicbrainz"))
+        connection.execute(sql_text("CREATE SCHEMA waveplot"))
+        Base.metadata.create_all(connection)
+
+        # The tables are empty, so sequential scans would otherwise win.
+        connection.execute(sql_text("SET LOCAL enable_seqscan = off"))
+
+        yield connection
+        transaction.rollback()
+    engine.dispose()
+
+
+def _plan(connection, query):
+    statement = query.statement.compile(dialect=connection.dialect)
+    return '\n'.join(row[0] for row in connection.exec_driver_sql(
+        'EXPLAIN ' + str(statement), statement.params
+    ))
+
+
+def _uses_index(connection, plan, index):
+    names = connection.execute(_INDEX_NAMES, {
+        'name': 'waveplot.' + index, 'index': index
+    }).scalars()
+    return any(name in plan for name in names)
+
+
+def test_editor_edits(connection):
+    query = Session(bind=connection).query(Edit).filter(
+        Edit.editor_id == 1
+    ).order_by(Edit.time.desc()).limit(50)
+
+    plan = _plan(connection, query)
+    assert _uses_index(connection, plan, 'edit_idx_editor_time'), plan
+
+
+def test_waveplot_edits(connection):
+    query = Session(bind=connection).query(Edit).filter(
+        Edit.waveplot_gid == str(uuid.uuid4())
+    ).order_by(Edit.time.desc()).limit(50)
+
+    plan = _plan(connection, query)
+    assert _uses_index(connection, plan, 'edit_idx_waveplot_time'), plan
+
+
+def test_waveplot_contexts(connection):
+    query = Session(bind=connection).query(WavePlotContext).filter(
+        WavePlotContext.waveplot_gid == str(uuid.uuid4())
+    )
+
+    plan = _plan(connection, query)
+    assert _uses_index(connection, plan,
+                       'waveplot_context_idx_waveplot'), plan
@@ -0,0 +1,126 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Checks that updating a reference store adds, rewrites and deletes
+WavePlots to match the database.
+"""
+
+import datetime
+import hashlib
+import uuid
+
+import pytest
+
+from wpschema import reference
+from wpschema.waveplot import WavePlot, WavePlotData
+
+
+def _full(number):
+    return bytes(bytearray([number % 200])) * (100 + number)
+
+
+def _insert(connection, number, sonic_hash):
+    full = _full(number)
+    gid = uuid.UUID(int=number)
+    connection.execute(WavePlot.__table__.insert(), {
+        'gid': gid, 'duration': datetime.timedelta(seconds=number),
+        'source_type': u'mp3', 'num_channels': 2, 'dr_level': 10,
+        'image_hash': hashlib.sha1(full).digest(), 'preview': b'',
+        'thumbnail': b'', 'sonic_hash': sonic_hash, 'version': u'DAMSON'
+    })
+    connection.execute(WavePlotData.__table__.insert(), {
+        'gid': gid, 'full': full
+    })
+
+
+@pytest.fixture
+def engine(sqlite_engine):
+    WavePlot.metadata.create_all(sqlite_engine, tables=[
+        WavePlot.__table__, WavePlotData.__table__
+    ])
+
+    with sqlite_engine.begin() as connection:
+        for number in range(1, 6):
+            _insert(connection, number, number)
+
+    return sqlite_engine
+
+
+def _hashes(store):
+    return dict((store[row].gid.int, store[row].sonic_hash)
+                for row in store.gid_rows)
+
+
+def test_build(engine, tmpdir):
+    assert reference.update(engine, str(tmpdir), batch_size=2) == (5, 0)
+
+    store = reference.ReferenceStore(str(tmpdir))
+    assert _hashes(store) == dict((number, number) for number in range(1, 6))
+
+    waveplot = store.get(uuid.UUID(int=3))
+    assert bytes(waveplot.full) == _full(3)
+    assert waveplot.duration == 3.0
+    assert [candidate.gid.int for candidate in store.candidates(
+        3, 3.0, 2, radius=0
+    )] == [3]
+
+    # Nothing has changed since.
+    assert reference.update(engine, str(tmpdir), batch_size=2) == (0, 0)
+
+
+def test_update(engine, tmpdir):
+    reference.update(engine, str(tmpdir), batch_size=2)
+    store = reference.ReferenceStore(str(tmpdir))
+
+    table = WavePlot.__table__
+    with engine.begin() as connection:
+        connection.execute(table.update().where(
+            table.c.gid == uuid.UUID(int=2)
+        ).values(sonic_hash=200))
+
+        full = _full(40)
+        connection.execute(table.update().where(
+            table.c.gid == uuid.UUID(int=4)
+        ).values(image_hash=hashlib.sha1(full).digest()))
+        connection.execute(WavePlotData.__table__.update().where(
+            WavePlotData.gid == uuid.UUID(int=4)
+        ).values(full=full))
+
+        for gid in (uuid.UUID(int=1), uuid.UUID(int=5)):
+            connection.execute(WavePlotData.__table__.delete().where(
+                WavePlotData.gid == gid
+            ))
+            connection.execute(table.delete().where(table.c.gid == gid))
+
+        _insert(connection, 6, 6)
+
+    # The sonic hash of 2 is rewritten without fetching its waveform, and
+    # the waveforms of 4 and 6 are fetched.
+    assert reference.update(engine, str(tmpdir), batch_size=2) == (2, 2)
+
+    # Readers see deletions before they reload.
+    assert store.get(uuid.UUID(int=1)) is None
+    assert bytes(store.get(uuid.UUID(int=4)).full) == full
+
+    store.reload()
+    assert _hashes(store) == {2: 200, 3: 3, 4: 4, 6: 6}
+    assert store.candidates(2, 2.0, 2, radius=0) == []
+    assert [candidate.gid.int for candidate in store.candidates(
+        200, 2.0, 2, radius=0
+    )] == [2]
+    assert bytes(store.get(uuid.UUID(int=4)).full) == full
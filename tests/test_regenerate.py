@@ -0,0 +1,49 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Checks that the regenerate job refuses to run with a libwaveplot of
+another version than the one it sets.
+"""
+
+import pytest
+
+from wpschema import _waveplot, regenerate
+
+
+class _Lib(object):
+    def version(self):
+        return b'CITRUS'
+
+
+@pytest.fixture
+def lib(monkeypatch):
+    monkeypatch.setattr(_waveplot.WavePlot, 'lib', _Lib())
+
+
+def test_check_version(lib):
+    regenerate.check_version('CITRUS')
+
+    with pytest.raises(ValueError):
+        regenerate.check_version('DAMSON')
+
+
+def test_main_wrong_version(lib, capsys):
+    # The version is checked before the database is used.
+    assert regenerate.main(['--database', 'sqlite://',
+                            '--to-version', 'DAMSON']) == 1
+    assert 'not DAMSON' in capsys.readouterr().err
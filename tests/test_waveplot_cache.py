@@ -0,0 +1,59 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests the size accounting of the local WavePlot cache."""
+
+import hashlib
+import uuid
+
+from wpschema._waveplot_cache import WavePlotCache
+
+
+def _entry(number, size):
+    full = bytes(bytearray([number % 200])) * size
+    return {
+        'gid': str(uuid.UUID(int=number)),
+        'image_sha1': hashlib.sha1(full).hexdigest(),
+    }, full
+
+
+def test_store_replacing_entry(tmpdir):
+    cache = WavePlotCache(str(tmpdir), max_bytes=250)
+    metadata, full = _entry(1, 100)
+
+    for _ in range(5):
+        cache.store(metadata, full)
+
+    assert cache._size == 100
+
+    other_metadata, other_full = _entry(2, 100)
+    cache.store(other_metadata, other_full)
+
+    # Both entries fit, so neither is evicted.
+    assert cache.load(metadata['gid']) is not None
+    assert cache.load(other_metadata['gid']) is not None
+
+
+def test_evict(tmpdir):
+    cache = WavePlotCache(str(tmpdir), max_bytes=250)
+
+    for number in range(1, 4):
+        cache.store(*_entry(number, 100))
+
+    assert cache._size == 200
+    assert WavePlotCache(str(tmpdir))._size == 200
@@ -19,7 +19,10 @@
 the wpschema package.
 """
 
-from wpschema.waveplot import Edit, Editor, Question, WavePlot, WavePlotContext
+from wpschema.waveplot import (
+    Edit, Editor, Question, WavePlot, WavePlotContext, WavePlotData
+)
+from wpschema.browse import WavePlotContextSummary
 from wpschema.musicbrainz import (
     Area, AreaType, Artist, ArtistCredit, ArtistType, Gender, Language, Medium,
     Recording, RecordingRedirect, Release, ReleaseRedirect, ReleaseGroup,
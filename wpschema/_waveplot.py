@@ -28,12 +28,24 @@ import requests
 import base64
 import json
 import zlib
-import simplejson
 import sys
 import hashlib
+import struct
+
+import numpy
 
 from ctypes import Structure, c_char_p, c_uint32, c_uint8, c_uint16, POINTER, \
     c_float, c_size_t, cdll
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from wpschema import matching
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 THUMB_IMAGE_WIDTH = 50
 THUMB_IMAGE_HEIGHT = 21
@@ -41,7 +53,27 @@ THUMB_IMAGE_HEIGHT = 21
 PREVIEW_IMAGE_WIDTH = 400
 PREVIEW_IMAGE_HEIGHT = 151
 
-SERVER = b'http://waveplot.net'
+SERVER = 'http://waveplot.net'
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_TIMEOUT = 30
+
+# Binary framing of WavePlot data, sent instead of base64 in JSON when both
+# ends support it. A frame is a fixed header (magic, frame version,
+# compression, metadata length, payload length), followed by the metadata as
+# JSON and the full waveform, compressed.
+BINARY_CONTENT_TYPE = 'application/x-waveplot'
+BINARY_ACCEPT = BINARY_CONTENT_TYPE + ', application/json;q=0.5'
+
+_FRAME_MAGIC = b'WPLT'
+_FRAME_VERSION = 1
+_FRAME_HEADER = struct.Struct('>4sBBII')
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
 
 
 class _File(Structure):
@@ -89,15 +121,381 @@ class _WavePlot(Structure):
     ]
 
 
+class Client(object):
+    """ A connection to a WavePlot server, which keeps a pool of HTTP
+    connections alive between requests. Requests are retried with
+    exponential backoff on connection errors, and GET requests are also
+    retried on server errors. """
+
+    def __init__(self, server=SERVER, pool_size=DEFAULT_POOL_SIZE,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 timeout=DEFAULT_TIMEOUT, binary=False):
+        self.server = server
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+        # Whether to upload using binary frames. This is turned off if the
+        # server responds that it doesn't support them.
+        self.binary = binary
+
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=(500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._threads = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._threads is not None:
+            self._threads.close()
+            self._threads.join()
+            self._threads = None
+
+        self.session.close()
+
+    def get(self, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(self.server + path, **kwargs)
+
+    def post_json(self, path, data, compress=False, **kwargs):
+        """ Posts data as JSON, compressing the body with zlib (HTTP deflate
+        encoding) if compress is True. """
+
+        kwargs.setdefault('timeout', self.timeout)
+
+        body = json.dumps(data)
+        headers = {'content-type': 'application/json'}
+        if compress:
+            body = zlib.compress(body.encode('utf-8'))
+            headers['content-encoding'] = 'deflate'
+
+        return self.session.post(self.server + path, data=body,
+                                 headers=headers, **kwargs)
+
+    def post_binary(self, path, metadata, full, **kwargs):
+        """ Posts metadata and a full waveform as a binary frame. """
+
+        kwargs.setdefault('timeout', self.timeout)
+
+        return self.session.post(
+            self.server + path, data=pack_waveplot(metadata, full),
+            headers={'content-type': BINARY_CONTENT_TYPE}, **kwargs
+        )
+
+    def _get_request(self, request):
+        if isinstance(request, tuple):
+            path, headers = request
+            return self.get(path, headers=headers)
+        return self.get(request)
+
+    def get_concurrently(self, *paths):
+        """ Sends a GET request for each of the provided paths, or (path,
+        headers) tuples, at the same time, returning the responses in the
+        same order. """
+
+        if self._threads is None:
+            self._threads = ThreadPool(self.pool_size)
+
+        return self._threads.map(self._get_request, paths)
+
+
+_default_client = None
+
+
+def default_client():
+    """ Returns the Client shared by WavePlots when no Client is given. """
+
+    global _default_client
+    if _default_client is None:
+        _default_client = Client()
+    return _default_client
+
+
+def _compress(data, compression):
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compress(data)
+    elif compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd compression requested, but zstandard "
+                             "isn't installed")
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def _decompress(data, compression):
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(data)
+    elif compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd compressed frame, but zstandard isn't "
+                             "installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif compression == COMPRESSION_NONE:
+        return data
+    raise ValueError("Unknown frame compression {}".format(compression))
+
+
+def pack_waveplot(metadata, full, compression=None):
+    """ Packs a dict of metadata and a full waveform into a binary frame,
+    using zstd compression if available, or zlib otherwise. """
+
+    if compression is None:
+        if zstandard is None:
+            compression = COMPRESSION_ZLIB
+        else:
+            compression = COMPRESSION_ZSTD
+
+    header = json.dumps(metadata).encode('utf-8')
+    payload = _compress(bytes(full), compression)
+
+    return _FRAME_HEADER.pack(_FRAME_MAGIC, _FRAME_VERSION, compression,
+                              len(header), len(payload)) + header + payload
+
+
+def unpack_waveplot(frame):
+    """ Unpacks a binary frame, returning a (metadata, full) tuple. """
+
+    frame = memoryview(frame)
+
+    magic, version, compression, header_length, payload_length = \
+        _FRAME_HEADER.unpack_from(frame)
+
+    if magic != _FRAME_MAGIC or version != _FRAME_VERSION:
+        raise ValueError("Not a version {} WavePlot frame".format(
+            _FRAME_VERSION
+        ))
+
+    start = _FRAME_HEADER.size
+    metadata = json.loads(frame[start:start + header_length].tobytes()
+                          .decode('utf-8'))
+
+    start += header_length
+    payload = frame[start:start + payload_length].tobytes()
+    if len(payload) != payload_length:
+        raise ValueError("Truncated WavePlot frame")
+
+    return metadata, _decompress(payload, compression)
+
+
+def _batch_results(response, count):
+    try:
+        results = response.json()['results']
+    except (ValueError, KeyError):
+        results = None
+
+    if results is None or len(results) != count:
+        print("Error: Batch response doesn't contain a result per item!")
+        message = {'message': 'Unknown'}
+
+        # A successful status would make callers read the missing results,
+        # so report the items as failed with a pseudo-status of 0 instead.
+        status_code = response.status_code
+        if 200 <= status_code < 300:
+            status_code = 0
+
+        return [(status_code, message)] * count
+
+    return [(result['status'], result) for result in results]
+
+
+def upload_batch(waveplots, editor_key, client=None):
+    """ Uploads many WavePlots in a single compressed request. The result
+    for each WavePlot, including the 303 status for WavePlots which already
+    exist on the server, is applied as if each had been uploaded alone. """
+
+    client = client or default_client()
+
+    data = {
+        'editor': editor_key,
+        'waveplots': [waveplot._upload_data(editor_key)
+                      for waveplot in waveplots]
+    }
+
+    response = client.post_json('/api/waveplots', data, compress=True)
+
+    results = _batch_results(response, len(waveplots))
+    for waveplot, (status_code, result) in zip(waveplots, results):
+        waveplot._set_upload_result(status_code, result)
+
+
+def link_batch(links, client=None):
+    """ Links each of a list of (waveplot, metadata) pairs in a single
+    compressed request, returning whether each link succeeded. """
+
+    client = client or default_client()
+
+    data = {
+        'contexts': [waveplot._link_data(metadata)
+                     for waveplot, metadata in links]
+    }
+
+    response = client.post_json('/api/waveplot_contexts', data,
+                                compress=True)
+
+    succeeded = []
+    for status_code, result in _batch_results(response, len(links)):
+        ok = 200 <= status_code < 300
+        if not ok:
+            print("Error: " + result.get('message', 'Unknown'))
+        succeeded.append(ok)
+
+    return succeeded
+
+
+def _text(value):
+    """ Decodes the bytes of a ctypes string, such as the source type or
+    version of a generated WavePlot. """
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def _float_array(pointer, length):
+    """ Returns a numpy view of length floats at a ctypes float pointer. """
+    if length == 0:
+        return numpy.zeros(0, dtype=numpy.float32)
+    return numpy.ctypeslib.as_array(pointer, shape=(length,))
+
+
+def _full_to_values(full):
+    """ Scales the bytes of a full waveform to the floats used by
+    libwaveplot, returning a ctypes float array which shares its memory
+    with a numpy array. """
+    values = numpy.frombuffer(full, dtype=numpy.uint8) / 200.0
+    return numpy.ctypeslib.as_ctypes(values.astype(numpy.float32))
+
+
+def _values_to_full(values):
+    """ Scales libwaveplot floats to the bytes of a full waveform. """
+    return (values.astype(numpy.float64) * 200.0).astype(numpy.uint8).tobytes()
+
+
+class Generator(object):
+    """ Generates WavePlots from audio files on the local machine.
+
+    The native info and audio sample structures are allocated once and
+    reused for every file, with the audio sample buffers growing to fit the
+    largest decoded frame. The file, waveplot and DR structures accumulate
+    per-file state which libwaveplot has no way to reset, so they are
+    allocated for each file. Everything is freed on close, or when used as a
+    context manager, even if generation fails. """
+
+    def __init__(self):
+        if WavePlot.lib is None:
+            WavePlot._init_libwaveplot()
+
+        self.lib = WavePlot.lib
+
+        self.i_ptr = self.lib.alloc_info()
+        self.a_ptr = self.lib.alloc_audio_samples()
+        if not self.a_ptr:
+            self.lib.free_info(self.i_ptr)
+            raise MemoryError("Ran out of memory attempting to allocate audio"
+                              "samples")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.a_ptr is not None:
+            self.lib.free_audio_samples(self.a_ptr)
+            self.a_ptr = None
+
+        if self.i_ptr is not None:
+            self.lib.free_info(self.i_ptr)
+            self.i_ptr = None
+
+    def generate(self, audio_path, waveplot=None):
+        """ Generates a WavePlot from an audio file, storing the results in
+        waveplot if provided, or a new WavePlot otherwise. Returns the
+        WavePlot. """
+
+        if not os.path.isfile(audio_path):
+            raise IOError("File {} not found".format(audio_path))
+
+        if waveplot is None:
+            waveplot = WavePlot()
+
+        i_ptr = self.i_ptr
+        a_ptr = self.a_ptr
+
+        f_ptr = self.lib.alloc_file()
+        w_ptr = self.lib.alloc_waveplot()
+        d_ptr = self.lib.alloc_dr()
+
+        try:
+            waveplot.path = os.path.abspath(audio_path).encode("utf-8")
+
+            result = self.lib.load_file(waveplot.path, f_ptr)
+            if result < 0:
+                raise IOError("Error loading file {!r}".format(waveplot.path))
+
+            self.lib.get_info(i_ptr, f_ptr)
+
+            self.lib.init_dr(d_ptr, i_ptr)
+
+            decoded = self.lib.get_samples(a_ptr, f_ptr, i_ptr)
+            while decoded >= 0:
+                if decoded > 0:
+                    self.lib.update_waveplot(w_ptr, a_ptr, i_ptr)
+                    self.lib.update_dr(d_ptr, a_ptr, i_ptr)
+                decoded = self.lib.get_samples(a_ptr, f_ptr, i_ptr)
+
+            self.lib.finish_waveplot(w_ptr)
+            self.lib.finish_dr(d_ptr, i_ptr)
+
+            # Set instance variables
+            values = w_ptr.contents
+            dr_data = d_ptr.contents
+            info = i_ptr.contents
+
+            waveplot.gid = None
+            waveplot.duration = info.duration_secs
+
+            waveplot.dr_level = dr_data.rating
+
+            waveplot.source_type = info.file_format
+            waveplot.sample_rate = info.sample_rate
+            waveplot.bit_depth = info.bit_depth
+            waveplot.bit_rate = info.bit_rate
+
+            waveplot.num_channels = info.num_channels
+
+            waveplot.image_hash = None
+            waveplot.full = _values_to_full(_float_array(values.values,
+                                                         values.length))
+            waveplot.preview = None
+            waveplot.thumbnail = None
+            waveplot.sonic_hash = None
+
+            waveplot.version = self.lib.version()
+        finally:
+            self.lib.free_dr(d_ptr)
+            self.lib.free_waveplot(w_ptr)
+            self.lib.free_file(f_ptr)
+
+        return waveplot
+
+
 class WavePlot(object):
     lib = None
 
     def __init__(self, *args, **kwargs):
         super(WavePlot, self).__init__(*args, **kwargs)
 
-        if self.lib is None:
-            WavePlot._init_libwaveplot()
-
         self.gid = None
         self.duration = None
 
@@ -110,6 +508,8 @@ class WavePlot(object):
 
         self.num_channels = None
 
+        # The hex SHA-1 digest of full, as used by the web API. The database
+        # stores the raw digest, given by get_image_hash().digest().
         self.image_hash = None
         self.full = None
         self.preview = None
@@ -142,137 +542,87 @@ class WavePlot(object):
         cls.lib.generate_sonic_hash.restype = c_uint16
 
     def _get_waveplot_ptr(self):
+        if self.lib is None:
+            WavePlot._init_libwaveplot()
+
         w_ptr = self.lib.alloc_waveplot()
 
-        scaled_data = [float(x)/200.0 for x in bytearray(self.full)]
+        values = _full_to_values(self.full)
 
-        w_ptr.contents.values = (c_float * len(scaled_data))(*scaled_data)
-        w_ptr.contents.length = len(scaled_data)
-        w_ptr.contents.capacity = len(scaled_data)
+        w_ptr.contents.values = values
+        w_ptr.contents.length = len(values)
+        w_ptr.contents.capacity = len(values)
 
         return w_ptr
 
     def generate(self, audio_path):
         """ Generates a WavePlot from an audio file on the local machine. """
 
-        # Load required data structures
-        f_ptr = self.lib.alloc_file()
-        i_ptr = self.lib.alloc_info()
-        w_ptr = self.lib.alloc_waveplot()
-        d_ptr = self.lib.alloc_dr()
-
-        if not os.path.isfile(audio_path):
-            raise IOError("File {} not found".format(audio_path))
-
-        self.path = os.path.abspath(audio_path).encode("utf-8")
-
-        result = self.lib.load_file(self.path, f_ptr)
-        if result < 0:
-            raise IOError("Error loading file {!r}".format(self.path))
-
-        self.lib.get_info(i_ptr, f_ptr)
-
-        self.lib.init_dr(d_ptr, i_ptr)
-
-        a_ptr = self.lib.alloc_audio_samples()
-        if not a_ptr:
-            raise MemoryError("Ran out of memory attempting to allocate audio"
-                              "samples")
-
-        decoded = self.lib.get_samples(a_ptr, f_ptr, i_ptr)
-        while decoded >= 0:
-            if decoded > 0:
-                self.lib.update_waveplot(w_ptr, a_ptr, i_ptr)
-                self.lib.update_dr(d_ptr, a_ptr, i_ptr)
-            decoded = self.lib.get_samples(a_ptr, f_ptr, i_ptr)
-
-        self.lib.finish_waveplot(w_ptr)
-        self.lib.finish_dr(d_ptr, i_ptr)
-
-        # Set instance variables
-        waveplot = w_ptr.contents
-        dr_data = d_ptr.contents
-        info = i_ptr.contents
-
-        self.gid = None
-        self.duration = info.duration_secs
-
-        self.dr_level = dr_data.rating
-
-        self.source_type = info.file_format
-        self.sample_rate = info.sample_rate
-        self.bit_depth = info.bit_depth
-        self.bit_rate = info.bit_rate
-
-        self.num_channels = info.num_channels
-
-        self.image_hash = None
-        self.full = bytes(bytearray(int(200.0*waveplot.values[x])
-                                    for x in range(waveplot.length)))
-        self.preview = None
-        self.thumbnail = None
-        self.sonic_hash = None
-
-        self.version = self.lib.version()
-
-        self.lib.free_dr(d_ptr)
-        self.lib.free_waveplot(w_ptr)
-        self.lib.free_audio_samples(a_ptr)
-        self.lib.free_info(i_ptr)
-        self.lib.free_file(f_ptr)
+        with Generator() as generator:
+            generator.generate(audio_path, self)
 
     def get_image_hash(self):
         return hashlib.sha1(self.full)
 
-    def generate_preview(self):
-        w_ptr = self._get_waveplot_ptr()
-
-        self.lib.resample_waveplot(w_ptr, PREVIEW_IMAGE_WIDTH,
-                                   int(PREVIEW_IMAGE_HEIGHT / 2))
-
-        resampled_data = [int(w_ptr.contents.resample[x])
-                          for x in range(PREVIEW_IMAGE_WIDTH)]
-
+    def _free_waveplot_ptr(self, w_ptr):
+        # The values are owned by Python, so mustn't be freed by libwaveplot.
         w_ptr.contents.values = POINTER(c_float)()
 
         self.lib.free_waveplot(w_ptr)
 
-        self.preview = bytes(bytearray(resampled_data))
+    def _resample(self, w_ptr, width, height):
+        self.lib.resample_waveplot(w_ptr, width, int(height / 2))
 
-    def generate_thumbnail(self):
-        w_ptr = self._get_waveplot_ptr()
-
-        self.lib.resample_waveplot(w_ptr, THUMB_IMAGE_WIDTH,
-                                   int(THUMB_IMAGE_HEIGHT / 2))
-
-        resampled_data = [int(w_ptr.contents.resample[x])
-                          for x in range(THUMB_IMAGE_WIDTH)]
+        resampled_data = _float_array(w_ptr.contents.resample, width)
 
-        w_ptr.contents.values = POINTER(c_float)()
+        return resampled_data.astype(numpy.uint8).tobytes()
 
-        self.lib.free_waveplot(w_ptr)
+    def generate_preview(self):
+        w_ptr = self._get_waveplot_ptr()
+        try:
+            self.preview = self._resample(w_ptr, PREVIEW_IMAGE_WIDTH,
+                                          PREVIEW_IMAGE_HEIGHT)
+        finally:
+            self._free_waveplot_ptr(w_ptr)
 
-        self.thumbnail = bytes(bytearray(resampled_data))
+    def generate_thumbnail(self):
+        w_ptr = self._get_waveplot_ptr()
+        try:
+            self.thumbnail = self._resample(w_ptr, THUMB_IMAGE_WIDTH,
+                                            THUMB_IMAGE_HEIGHT)
+        finally:
+            self._free_waveplot_ptr(w_ptr)
 
     def generate_sonic_hash(self):
         w_ptr = self._get_waveplot_ptr()
-
-        result = self.lib.generate_sonic_hash(w_ptr)
+        try:
+            result = self.lib.generate_sonic_hash(w_ptr)
+        finally:
+            self._free_waveplot_ptr(w_ptr)
 
         self.sonic_hash = result
 
         return result
 
-    def get(self, wp_uuid):
-        url = SERVER + b'/api/waveplot/{}'.format(wp_uuid)
+    def derive_all(self):
+        """ Generates the preview, thumbnail, sonic hash and image hash of
+        this WavePlot, scaling the full waveform into a native waveplot only
+        once for all of them. Like the image hash fetched from the server,
+        image_hash is set to the hex digest. """
 
-        response = requests.get(url)
-
-        metadata = response.json()
+        w_ptr = self._get_waveplot_ptr()
+        try:
+            self.preview = self._resample(w_ptr, PREVIEW_IMAGE_WIDTH,
+                                          PREVIEW_IMAGE_HEIGHT)
+            self.thumbnail = self._resample(w_ptr, THUMB_IMAGE_WIDTH,
+                                            THUMB_IMAGE_HEIGHT)
+            self.sonic_hash = self.lib.generate_sonic_hash(w_ptr)
+        finally:
+            self._free_waveplot_ptr(w_ptr)
 
-        response = requests.get(url + "/full")
-        waveplot_data = response.json()
+        self.image_hash = self.get_image_hash().hexdigest()
 
+    def _set_metadata(self, metadata):
         self.gid = metadata['gid']
         self.duration = metadata['duration']
 
@@ -291,60 +641,149 @@ class WavePlot(object):
 
         self.version = metadata['version']
 
-        self.full = base64.b64decode(waveplot_data['data'])
+    def get(self, wp_uuid, client=None, cache=None):
+        """ Fetches the WavePlot with the provided gid from the server. If a
+        wpschema._waveplot_cache.WavePlotCache is provided, the WavePlot is
+        loaded from it if present, and stored in it otherwise. """
+
+        if cache is not None:
+            cached = cache.load(wp_uuid)
+            if cached is not None:
+                metadata, self.full = cached
+                self._set_metadata(metadata)
+                return
+
+        client = client or default_client()
 
-    def upload(self, editor_key):
-        url = SERVER + b'/api/waveplot'
+        path = '/api/waveplot/{}'.format(wp_uuid)
 
-        data = {
+        # Fetch the metadata and full data at the same time, preferring a
+        # binary frame for the full data
+        response, full_response = client.get_concurrently(
+            path, (path + '/full', {'accept': BINARY_ACCEPT})
+        )
+
+        metadata = response.json()
+        self._set_metadata(metadata)
+
+        content_type = full_response.headers.get('content-type', '')
+        if content_type.startswith(BINARY_CONTENT_TYPE):
+            _, self.full = unpack_waveplot(full_response.content)
+        else:
+            self.full = base64.b64decode(full_response.json()['data'])
+
+        if cache is not None:
+            cache.store(metadata, self.full)
+
+    def _upload_data(self, editor_key):
+        data = self._upload_metadata(editor_key)
+        data['image'] = base64.b64encode(zlib.compress(self.full)).decode(
+            'ascii'
+        )
+        return data
+
+    def _upload_metadata(self, editor_key):
+        return {
             'editor': editor_key,
-            'image': base64.b64encode(zlib.compress(self.full)),
             'dr_level': self.dr_level,
             'duration': self.duration,
-            'source_type': self.source_type,
+            'source_type': _text(self.source_type),
             'sample_rate': self.sample_rate,
             'bit_depth': self.bit_depth,
             'bit_rate': self.bit_rate,
             'num_channels': self.num_channels,
-            'version': self.version
+            'version': _text(self.version)
         }
 
-        response = requests.post(url, data=json.dumps(data), headers={
-            'content-type': 'application/json',
-        })
+    def _set_upload_result(self, status_code, data):
+        # As with batch results, a successful status without the result, for
+        # example with a body which isn't JSON, is a failed upload.
+        if 200 <= status_code < 300:
+            required = 'gid'
+        elif status_code == 303:
+            required = 'message'
+        else:
+            required = None
 
-        try:
-            data = response.json()
-        except simplejson.scanner.JSONDecodeError:
-            print("Error: No JSON object in response!")
+        if required is not None and required not in data:
+            print("Error: Upload response doesn't contain a result!")
+            return
 
-        if response.status_code < 300:
+        if 200 <= status_code < 300:
             self.gid = data['gid']
             self.image_hash = data['image_hash']
             self.thumbnail = data['thumbnail']
             self.sonic_hash = data['sonic_hash']
-        elif response.status_code == 303:
+        elif status_code == 303:
             self.gid = data['message']
         else:
             print("Error: " + data.get('message', 'Unknown'))
 
-    def link(self, metadata):
-        url = SERVER + b'/api/waveplot_context'
+    def upload(self, editor_key, client=None):
+        client = client or default_client()
+
+        response = None
+        if client.binary:
+            response = client.post_binary('/api/waveplot',
+                                          self._upload_metadata(editor_key),
+                                          self.full)
+
+            # Unsupported Media Type, so fall back to JSON from now on
+            if response.status_code == 415:
+                client.binary = False
+                response = None
 
+        if response is None:
+            response = client.post_json('/api/waveplot',
+                                        self._upload_data(editor_key))
+
+        try:
+            data = response.json()
+        except ValueError:
+            print("Error: No JSON object in response!")
+            data = {}
+
+        self._set_upload_result(response.status_code, data)
+
+    def _link_data(self, metadata):
         data = metadata
         data.update({'waveplot_uuid': self.gid})
+        return data
 
-        response = requests.post(url, data=json.dumps(data), headers={
-            'content-type': 'application/json',
-        })
+    def link(self, metadata, client=None):
+        client = client or default_client()
+
+        data = self._link_data(metadata)
+
+        response = client.post_json('/api/waveplot_context', data)
 
         try:
             data = response.json()
-        except simplejson.scanner.JSONDecodeError:
+        except ValueError:
             print("Error: No JSON object in response!")
+            data = {}
 
         if response.status_code >= 300:
             print("Error: " + data.get('message', 'Unknown'))
 
-    def match(self):
-        pass
+    def match(self, index, radius=matching.DEFAULT_RADIUS,
+              duration_tolerance=matching.DEFAULT_DURATION_TOLERANCE,
+              max_distance=None):
+        """ Finds WavePlots similar to this one in a
+        wpschema.matching.SonicHashIndex. Candidates are selected by sonic
+        hash, channel count and duration, then ranked by comparing full
+        waveforms. Returns a list of (distance, WavePlot) tuples, closest
+        first. """
+
+        if self.sonic_hash is None:
+            self.generate_sonic_hash()
+
+        candidates = [
+            candidate for candidate in index.candidates(
+                self.sonic_hash, self.duration, self.num_channels, radius,
+                duration_tolerance
+            ) if candidate is not self
+        ]
+
+        return matching.rank(self.full, candidates, max_distance)
+
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2014 Ben Ockmore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Provides an asyncio counterpart to the network methods of
+wpschema._waveplot.WavePlot, allowing many requests to be in flight at once.
+This module requires Python 3 and aiohttp.
+"""
+
+import asyncio
+import base64
+import json
+
+import aiohttp
+
+from wpschema._waveplot import (BINARY_ACCEPT, BINARY_CONTENT_TYPE,
+                                DEFAULT_TIMEOUT, SERVER, unpack_waveplot)
+
+DEFAULT_CONCURRENCY = 50
+
+
+class TokenBucket(object):
+    """ Limits the rate of requests on the client side, in the same units
+    as the query_rate of wpschema.waveplot.Editor (requests per minute).
+    Up to a second's worth of requests may be made in a burst. """
+
+    def __init__(self, query_rate):
+        if query_rate <= 0:
+            raise ValueError("query_rate must be positive, not {!r}".format(
+                query_rate
+            ))
+
+        self.rate = query_rate / 60.0
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = None
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """ Waits until a request may be made. """
+
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self.updated is not None:
+                    self.tokens = min(
+                        self.capacity,
+                        self.tokens + (now - self.updated) * self.rate
+                    )
+                self.updated = now
+
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+
+class AsyncClient(object):
+    """ An asyncio connection to a WavePlot server. At most concurrency
+    requests are in flight at once and, if query_rate is given, requests
+    are limited to that many per minute. Use as an async context manager.
+    """
+
+    def __init__(self, server=SERVER, concurrency=DEFAULT_CONCURRENCY,
+                 query_rate=None, timeout=DEFAULT_TIMEOUT):
+        self.server = server
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+        self.bucket = None if query_rate is None else TokenBucket(query_rate)
+
+        self.semaphore = None
+        self.session = None
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _send(self, method, path, data=None, headers=None):
+        """ Returns the status, content type and body of a response. """
+
+        async with self.semaphore:
+            if self.bucket is not None:
+                await self.bucket.acquire()
+
+            async with self.session.request(method, self.server + path,
+                                            json=data,
+                                            headers=headers) as response:
+                return (response.status, response.content_type,
+                        await response.read())
+
+    async def _request(self, method, path, data=None):
+        status, _, body = await self._send(method, path, data)
+
+        try:
+            result = json.loads(body.decode('utf-8'))
+        except ValueError:
+            print("Error: No JSON object in response!")
+            result = None
+
+        # An empty or null body is treated like the sync client's fallback.
+        if result is None:
+            result = {}
+
+        return status, result
+
+    async def _get_full(self, path):
+        # Prefer a binary frame, as WavePlot.get does.
+        status, content_type, body = await self._send(
+            'GET', path, headers={'accept': BINARY_ACCEPT}
+        )
+
+        if content_type.startswith(BINARY_CONTENT_TYPE):
+            return unpack_waveplot(body)[1]
+        return base64.b64decode(json.loads(body.decode('utf-8'))['data'])
+
+    async def get(self, waveplot, wp_uuid):
+        """ Fetches the WavePlot with the provided gid into waveplot. """
+
+        path = '/api/waveplot/{}'.format(wp_uuid)
+
+        (_, metadata), full = await asyncio.gather(
+            self._request('GET', path), self._get_full(path + '/full')
+        )
+
+        waveplot._set_metadata(metadata)
+        waveplot.full = full
+
+        return waveplot
+
+    async def upload(self, waveplot, editor_key):
+        status, data = await self._request(
+            'POST', '/api/waveplot', waveplot._upload_data(editor_key)
+        )
+
+        waveplot._set_upload_result(status, data)
+
+        return waveplot
+
+    async def link(self, waveplot, metadata):
+        status, data = await self._request(
+            'POST', '/api/waveplot_context', waveplot._link_data(metadata)
+        )
+
+        if status >= 300:
+            print("Error: " + data.get('message', 'Unknown'))
+
+        return status < 300
+
+    async def upload_all(self, waveplots, editor_key):
+        """ Uploads all of the provided WavePlots concurrently. """
+        return await asyncio.gather(*[
+            self.upload(waveplot, editor_key) for waveplot in waveplots
+        ])
+
+    async def link_all(self, links):
+        """ Links each (waveplot, metadata) pair concurrently, returning
+        whether each link succeeded. """
+        return await asyncio.gather(*[
+            self.link(waveplot, metadata) for waveplot, metadata in links
+        ])
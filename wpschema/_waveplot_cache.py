@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2014 Ben Ockmore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Provides a local on-disk cache of WavePlots fetched from the server.
+
+WavePlots never change once they have a gid, so cached entries never need to
+be refreshed. Each entry is a raw full waveform file, which is memory mapped
+when loaded, and a JSON metadata file alongside it. Entries are checked
+against their image hash when loaded, and the least recently used entries are
+removed when the cache grows beyond its maximum size.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class WavePlotCache(object):
+    """ A size-bounded cache of WavePlot metadata and full waveforms, stored
+    in the provided directory. """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _path(self, gid, extension):
+        gid = str(gid)
+        return os.path.join(self.directory, gid[:2], gid + extension)
+
+    def _entries(self):
+        """ Yields a (last used time, size, gid) tuple for each entry. """
+
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                gid, extension = os.path.splitext(filename)
+                if extension != '.full':
+                    continue
+
+                try:
+                    stat = os.stat(os.path.join(dirpath, filename))
+                except OSError:
+                    continue
+
+                yield stat.st_mtime, stat.st_size, gid
+
+    def load(self, gid):
+        """ Returns a (metadata, full) tuple for the cached WavePlot with the
+        provided gid, where full is a read-only memory map, or None if the
+        WavePlot isn't cached or its data is corrupt. """
+
+        full_path = self._path(gid, '.full')
+        try:
+            with open(self._path(gid, '.json')) as metadata_file:
+                metadata = json.load(metadata_file)
+
+            with open(full_path, 'rb') as full_file:
+                if os.fstat(full_file.fileno()).st_size == 0:
+                    full = b''
+                else:
+                    full = mmap.mmap(full_file.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if hashlib.sha1(full).hexdigest() != metadata.get('image_sha1'):
+            self.remove(gid)
+            return None
+
+        # Record the use, for least recently used eviction
+        os.utime(full_path, None)
+
+        return metadata, full
+
+    def store(self, metadata, full):
+        """ Stores a WavePlot's metadata dict, as returned by the server, and
+        its full waveform. """
+
+        gid = metadata['gid']
+
+        full_path = self._path(gid, '.full')
+        directory = os.path.dirname(full_path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # An entry being replaced no longer counts towards the size
+        self._size -= self._full_size(gid)
+
+        # Write to temporary files and rename, so that concurrent readers
+        # never see partial entries
+        self._write(directory, full_path, bytes(full))
+        self._write(directory, self._path(gid, '.json'),
+                    json.dumps(metadata).encode('utf-8'))
+
+        self._size += len(full)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _write(self, directory, path, data):
+        descriptor, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(descriptor, 'wb') as temp_file:
+            temp_file.write(data)
+        os.rename(temp_path, path)
+
+    def _full_size(self, gid):
+        try:
+            return os.stat(self._path(gid, '.full')).st_size
+        except OSError:
+            return 0
+
+    def remove(self, gid):
+        self._size -= self._full_size(gid)
+
+        for extension in ('.full', '.json'):
+            try:
+                os.remove(self._path(gid, extension))
+            except OSError:
+                pass
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache is
+        within its maximum size. """
+
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+
+        for _, _, gid in entries:
+            if self._size <= self.max_bytes:
+                break
+
+            self.remove(gid)
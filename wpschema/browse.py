@@ -0,0 +1,213 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module defines a denormalised summary of each WavePlotContext, which
+carries the MusicBrainz names and positions needed to browse WavePlots
+without joining out to the musicbrainz schema, and the procedure used to keep
+it up to date.
+"""
+
+from sqlalchemy import (Column, DateTime, ForeignKey, Index, Integer, Unicode,
+                        UnicodeText, exists, func, select, union)
+from sqlalchemy.dialects.postgresql import UUID, insert
+from sqlalchemy.orm import relationship
+
+from wpschema.base import Base
+from wpschema.musicbrainz import (ArtistCredit, Medium, Recording, Release,
+                                  ReleaseGroup, Track)
+from wpschema.waveplot import WavePlotContext
+
+
+class WavePlotContextSummary(Base):
+    """Represents a WavePlotContext, along with the names and positions of
+    the MusicBrainz entities it links to. Rows are maintained by
+    refresh_context_summary.
+    """
+
+    __tablename__ = 'waveplot_context_summary'
+    __table_args__ = (
+        # Release page tracklists.
+        Index('waveplot_context_summary_idx_release', 'release_gid',
+              'medium_position', 'track_position'),
+        # Browsing by artist, then release.
+        Index('waveplot_context_summary_idx_artist_credit',
+              'artist_credit_name', 'release_name', 'medium_position',
+              'track_position'),
+        Index('waveplot_context_summary_idx_release_group',
+              'release_group_gid', 'release_name'),
+        {'schema': 'waveplot'}
+    )
+
+    context_id = Column(
+        Integer,
+        ForeignKey('waveplot.waveplot_context.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+
+    waveplot_gid = Column(UUID(as_uuid=True), nullable=False, index=True)
+
+    track_gid = Column(UUID(as_uuid=True), nullable=False)
+    track_name = Column(Unicode, nullable=False)
+    track_number = Column(UnicodeText, nullable=False)
+    track_position = Column(Integer, nullable=False)
+    track_length = Column(Integer)
+
+    medium_position = Column(Integer, nullable=False)
+
+    release_gid = Column(UUID(as_uuid=True), nullable=False)
+    release_name = Column(UnicodeText, nullable=False)
+
+    release_group_gid = Column(UUID(as_uuid=True), nullable=False)
+    release_group_name = Column(UnicodeText, nullable=False)
+
+    recording_gid = Column(UUID(as_uuid=True), nullable=False, index=True)
+    recording_name = Column(UnicodeText, nullable=False)
+
+    artist_credit_id = Column(Integer, nullable=False)
+    artist_credit_name = Column(UnicodeText, nullable=False)
+
+    # The latest last_updated time of the summarised MusicBrainz entities.
+    last_updated = Column(DateTime(timezone=True))
+
+    context = relationship('WavePlotContext')
+
+    def __repr__(self):
+        return '<WavePlotContextSummary {!r}>'.format(self.context_id)
+
+
+def _updated_contexts(since):
+    """Returns a select of the ids of contexts whose MusicBrainz entities
+    have been updated after since, as a union of one select per entity, so
+    that each can use the index on its last_updated added by
+    wpschema.migrate.prepare_summary_refresh.
+    """
+
+    context = WavePlotContext.__table__
+    track = context.join(Track.__table__, Track.gid == context.c.track_gid)
+    medium = track.join(Medium.__table__, Medium.id == Track.medium_id)
+    release = medium.join(Release.__table__, Release.id == Medium.release_id)
+
+    return union(
+        select([context.c.id]).select_from(track).where(
+            Track.last_updated > since
+        ),
+        select([context.c.id]).select_from(medium).where(
+            Medium.last_updated > since
+        ),
+        select([context.c.id]).select_from(release).where(
+            Release.last_updated > since
+        ),
+        select([context.c.id]).select_from(
+            release.join(ReleaseGroup.__table__,
+                         ReleaseGroup.id == Release.release_group_id)
+        ).where(ReleaseGroup.last_updated > since),
+        select([context.c.id]).select_from(
+            track.join(Recording.__table__, Recording.id == Track.recording_id)
+        ).where(Recording.last_updated > since),
+        select([context.c.id]).select_from(
+            context.join(ArtistCredit.__table__,
+                         ArtistCredit.id == context.c.artist_credit_id)
+        ).where(ArtistCredit.last_updated > since),
+    )
+
+
+def _summary_select():
+    last_updated = func.greatest(
+        Track.last_updated, Medium.last_updated, Release.last_updated,
+        ReleaseGroup.last_updated, Recording.last_updated,
+        ArtistCredit.last_updated
+    )
+
+    return select([
+        WavePlotContext.id.label('context_id'),
+        WavePlotContext.waveplot_gid,
+        Track.gid.label('track_gid'),
+        Track.name.label('track_name'),
+        Track.number.label('track_number'),
+        Track.position.label('track_position'),
+        Track.length.label('track_length'),
+        Medium.position.label('medium_position'),
+        Release.gid.label('release_gid'),
+        Release.name.label('release_name'),
+        ReleaseGroup.gid.label('release_group_gid'),
+        ReleaseGroup.name.label('release_group_name'),
+        Recording.gid.label('recording_gid'),
+        Recording.name.label('recording_name'),
+        ArtistCredit.id.label('artist_credit_id'),
+        ArtistCredit.name.label('artist_credit_name'),
+        last_updated.label('last_updated'),
+    ]).select_from(
+        WavePlotContext.__table__.join(
+            Track.__table__, Track.gid == WavePlotContext.track_gid
+        ).join(
+            Medium.__table__, Medium.id == Track.medium_id
+        ).join(
+            Release.__table__, Release.id == Medium.release_id
+        ).join(
+            ReleaseGroup.__table__, ReleaseGroup.id == Release.release_group_id
+        ).join(
+            Recording.__table__, Recording.id == Track.recording_id
+        ).join(
+            ArtistCredit.__table__,
+            ArtistCredit.id == WavePlotContext.artist_credit_id
+        )
+    ), last_updated
+
+
+def refresh_context_summary(connection, since=None, prune=False):
+    """Brings the context summary up to date.
+
+    Contexts without a summary are always added. If since is None, all
+    other summaries are rewritten, otherwise only those whose MusicBrainz
+    entities have been updated after since are. If prune is True, summaries
+    of contexts whose track no longer exists are removed.
+
+    Returns the latest last_updated time in the summary, which may be passed
+    as since to the next refresh, for example after each replication packet.
+    Incremental refreshes rely on the columns and indexes added to the
+    musicbrainz schema by wpschema.migrate.prepare_summary_refresh.
+    """
+
+    summary = WavePlotContextSummary.__table__
+
+    source, last_updated = _summary_select()
+
+    if since is not None:
+        source = source.where(
+            WavePlotContext.id.in_(_updated_contexts(since)) |
+            ~exists().where(summary.c.context_id == WavePlotContext.id)
+        )
+
+    statement = insert(summary).from_select(
+        [column.name for column in summary.columns], source
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[summary.c.context_id],
+        set_=dict((column.name, statement.excluded[column.name])
+                  for column in summary.columns if not column.primary_key)
+    )
+    connection.execute(statement)
+
+    if prune:
+        connection.execute(summary.delete().where(
+            ~exists().where(Track.gid == summary.c.track_gid)
+        ))
+
+    return connection.execute(
+        select([func.max(summary.c.last_updated)])
+    ).scalar()
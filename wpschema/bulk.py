@@ -0,0 +1,204 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module provides bulk loading of WavePlots, WavePlotContexts and the
+Edits which record them, using multi-row INSERT statements rather than one
+ORM object per row.
+
+Each item to be loaded is a (waveplot, contexts) tuple, where waveplot is a
+dict of WavePlot column values and contexts is a list of dicts of
+WavePlotContext column values (excluding waveplot_gid). WavePlots are
+deduplicated on image_hash by the database, so loading a WavePlot which
+already exists links the contexts to the existing WavePlot instead.
+"""
+
+import itertools
+import uuid
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from wpschema.waveplot import Edit, WavePlot, WavePlotContext, WavePlotData
+
+DEFAULT_BATCH_SIZE = 500
+
+# Edit types recorded for uploaded WavePlots and linked WavePlotContexts.
+UPLOAD_EDIT_TYPE = 1
+LINK_EDIT_TYPE = 2
+
+
+def _waveplot_row(waveplot):
+    row = dict((column.name, waveplot.get(column.name))
+               for column in WavePlot.__table__.columns)
+
+    if row['gid'] is None:
+        row['gid'] = uuid.uuid4()
+
+    return row
+
+
+def load_batch(connection, batch, editor_id,
+               upload_edit_type=UPLOAD_EDIT_TYPE,
+               link_edit_type=LINK_EDIT_TYPE):
+    """Loads a single batch of (waveplot, contexts) items using the provided
+    connection, which should already be in a transaction.
+
+    Returns a list of (gid, created) tuples, in the same order as the batch,
+    where created is False if a WavePlot with the same image_hash already
+    existed.
+    """
+
+    if not batch:
+        return []
+
+    waveplot_table = WavePlot.__table__
+
+    # Deduplicate within the batch before deduplicating against the table.
+    rows = {}
+    fulls = {}
+    for waveplot, _ in batch:
+        row = _waveplot_row(waveplot)
+        rows.setdefault(bytes(row['image_hash']), row)
+        fulls.setdefault(bytes(row['image_hash']), waveplot['full'])
+
+    statement = insert(waveplot_table).values(list(rows.values()))
+    statement = statement.on_conflict_do_nothing(
+        index_elements=[waveplot_table.c.image_hash]
+    ).returning(waveplot_table.c.gid, waveplot_table.c.image_hash)
+
+    created = dict((bytes(image_hash), gid)
+                   for gid, image_hash in connection.execute(statement))
+
+    if created:
+        connection.execute(WavePlotData.__table__.insert().values([{
+            'gid': gid,
+            'full': fulls[image_hash]
+        } for image_hash, gid in created.items()]))
+
+    gids = dict(created)
+    missing = [image_hash for image_hash in rows if image_hash not in gids]
+    if missing:
+        statement = select([
+            waveplot_table.c.gid, waveplot_table.c.image_hash
+        ]).where(waveplot_table.c.image_hash.in_(missing))
+
+        gids.update((bytes(image_hash), gid)
+                    for gid, image_hash in connection.execute(statement))
+
+    if created:
+        connection.execute(Edit.__table__.insert().values([{
+            'type': upload_edit_type,
+            'editor_id': editor_id,
+            'waveplot_gid': gid
+        } for gid in created.values()]))
+
+    # Only the first item with a given image_hash is reported as created.
+    unreported = set(created)
+
+    results = []
+    context_rows = []
+    for waveplot, contexts in batch:
+        image_hash = bytes(waveplot['image_hash'])
+        gid = gids[image_hash]
+
+        results.append((gid, image_hash in unreported))
+        unreported.discard(image_hash)
+
+        for context in contexts:
+            context_row = dict(context)
+            context_row['waveplot_gid'] = gid
+            context_rows.append(context_row)
+
+    link_contexts(connection, context_rows, editor_id, link_edit_type)
+
+    return results
+
+
+def link_contexts(connection, contexts, editor_id,
+                  link_edit_type=LINK_EDIT_TYPE):
+    """Inserts a list of dicts of WavePlotContext column values, including
+    waveplot_gid, along with an Edit for each, using the provided
+    connection. Returns the ids of the new contexts, in order.
+    """
+
+    if not contexts:
+        return []
+
+    context_table = WavePlotContext.__table__
+
+    statement = context_table.insert().values(list(contexts))
+    ids = [context_id for context_id, in connection.execute(
+        statement.returning(context_table.c.id)
+    )]
+
+    connection.execute(Edit.__table__.insert().values([{
+        'type': link_edit_type,
+        'editor_id': editor_id,
+        'waveplot_gid': context['waveplot_gid']
+    } for context in contexts]))
+
+    return ids
+
+
+def insert_batch(engine, editor_id, waveplots=(), contexts=(),
+                 upload_edit_type=UPLOAD_EDIT_TYPE,
+                 link_edit_type=LINK_EDIT_TYPE):
+    """Inserts a batch of uploaded WavePlots and linked WavePlotContexts, as
+    sent to the batch upload and link endpoints, in a single transaction.
+
+    waveplots is a list of dicts of WavePlot column values, and contexts a
+    list of dicts of WavePlotContext column values, including waveplot_gid.
+    Returns a tuple of the (gid, created) tuples for the WavePlots, which
+    the endpoint reports with a 201 or 303 status respectively, and the ids
+    of the new contexts.
+    """
+
+    with engine.begin() as connection:
+        uploaded = load_batch(
+            connection, [(waveplot, []) for waveplot in waveplots],
+            editor_id, upload_edit_type, link_edit_type
+        )
+        linked = link_contexts(connection, contexts, editor_id,
+                               link_edit_type)
+
+    return uploaded, linked
+
+
+def bulk_load(engine, items, editor_id, batch_size=DEFAULT_BATCH_SIZE,
+              upload_edit_type=UPLOAD_EDIT_TYPE,
+              link_edit_type=LINK_EDIT_TYPE):
+    """Loads an iterable of (waveplot, contexts) items, committing one
+    transaction per batch of batch_size items. The items are consumed lazily,
+    so arbitrarily large iterables can be loaded.
+
+    Yields a (gid, created) tuple for each item, in order, once the batch
+    containing it has been committed.
+    """
+
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, batch_size))
+        if not batch:
+            break
+
+        with engine.begin() as connection:
+            results = load_batch(connection, batch, editor_id,
+                                 upload_edit_type, link_edit_type)
+
+        for result in results:
+            yield result
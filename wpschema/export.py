@@ -0,0 +1,439 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module exports the waveplot and waveplot_context tables to chunked
+columnar files for offline analysis, and reads them back.
+
+Rows are streamed through a server-side cursor and written one chunk at a
+time, so memory use depends on the chunk size rather than the size of the
+tables. Chunks of WavePlots, whose rows include the full waveforms, are
+bounded by their size in bytes as well as by their number of rows. Two
+formats are supported:
+
+* npy, which writes NumPy .npy files: for each chunk of WavePlots, a
+  records file of the metadata columns, and the full waveforms packed end to
+  end in a full file, with an offsets file giving the start of each
+  waveform. Readers memory map these, so waveforms are read without copying.
+* parquet, which writes a Parquet file per chunk, and requires pyarrow.
+
+A manifest.json file listing the chunks is written last, once the export is
+complete. Run as a script:
+
+    python -m wpschema.export --database postgresql:///waveplot export/
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import numpy
+from sqlalchemy import create_engine, select
+
+from wpschema.waveplot import (WAVEPLOT_VERSIONS, WavePlot, WavePlotContext,
+                               WavePlotData)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMAT_NPY = 'npy'
+FORMAT_PARQUET = 'parquet'
+FORMATS = (FORMAT_NPY, FORMAT_PARQUET)
+
+DEFAULT_CHUNK_SIZE = 100000
+DEFAULT_CHUNK_BYTES = 256 * 1024 * 1024
+
+# The number of WavePlots, with their full waveforms, fetched from the
+# server-side cursor at a time.
+_WAVEPLOT_FETCH_SIZE = 100
+
+MANIFEST = 'manifest.json'
+MANIFEST_VERSION = 1
+
+# The sizes of the text fields of the npy format, from their columns.
+_SOURCE_TYPE_BYTES = WavePlot.__table__.c.source_type.type.length
+_VERSION_BYTES = max(len(version) for version in WAVEPLOT_VERSIONS)
+
+# Record dtypes of the npy format. Identifiers and fixed length binary
+# columns are stored as arrays of bytes, text as UTF-8 in fields sized for
+# the column, and durations in seconds.
+WAVEPLOT_DTYPE = numpy.dtype([
+    ('gid', numpy.uint8, (16,)),
+    ('duration', numpy.float64),
+    ('source_type', 'S{}'.format(_SOURCE_TYPE_BYTES)),
+    ('sample_rate', numpy.int32),
+    ('bit_depth', numpy.int16),
+    ('bit_rate', numpy.int32),
+    ('num_channels', numpy.int16),
+    ('dr_level', numpy.int16),
+    ('image_hash', numpy.uint8, (20,)),
+    ('sonic_hash', numpy.int32),
+    ('version', 'S{}'.format(_VERSION_BYTES)),
+    ('thumbnail', numpy.uint8, (50,)),
+])
+
+CONTEXT_DTYPE = numpy.dtype([
+    ('id', numpy.int32),
+    ('waveplot_gid', numpy.uint8, (16,)),
+    ('release_gid', numpy.uint8, (16,)),
+    ('recording_gid', numpy.uint8, (16,)),
+    ('track_gid', numpy.uint8, (16,)),
+    ('artist_credit_id', numpy.int32),
+])
+
+# Column types of the parquet format, as names of pyarrow type factories, so
+# that every chunk has the same schema even if a column is entirely null.
+WAVEPLOT_PARQUET_TYPES = [
+    ('gid', 'binary'), ('duration', 'float64'), ('source_type', 'string'),
+    ('sample_rate', 'int32'), ('bit_depth', 'int16'), ('bit_rate', 'int32'),
+    ('num_channels', 'int16'), ('dr_level', 'int16'),
+    ('image_hash', 'binary'), ('sonic_hash', 'int32'), ('version', 'string'),
+    ('thumbnail', 'binary'), ('full', 'binary'),
+]
+
+CONTEXT_PARQUET_TYPES = [
+    ('id', 'int32'), ('waveplot_gid', 'binary'), ('release_gid', 'binary'),
+    ('recording_gid', 'binary'), ('track_gid', 'binary'),
+    ('artist_credit_id', 'int32'),
+]
+
+_WAVEPLOT_COLUMNS = [
+    WavePlot.gid, WavePlot.duration, WavePlot.source_type,
+    WavePlot.sample_rate, WavePlot.bit_depth, WavePlot.bit_rate,
+    WavePlot.num_channels, WavePlot.dr_level, WavePlot.image_hash,
+    WavePlot.sonic_hash, WavePlot.version, WavePlot.thumbnail
+]
+
+_CONTEXT_COLUMNS = [
+    WavePlotContext.id, WavePlotContext.waveplot_gid,
+    WavePlotContext.release_gid, WavePlotContext.recording_gid,
+    WavePlotContext.track_gid, WavePlotContext.artist_credit_id
+]
+
+
+def _stream(connection, statement, chunk_size, fetch_size, chunk_bytes=None,
+            size=None):
+    """Yields lists of up to chunk_size rows, fetched fetch_size at a time
+    through a server-side cursor. If chunk_bytes is given, a list also ends
+    once the sizes of its rows, given by size(row), reach chunk_bytes.
+    """
+
+    result = connection.execution_options(
+        stream_results=True, yield_per=fetch_size
+    ).execute(statement)
+
+    rows = []
+    total = 0
+    for row in result:
+        rows.append(row)
+        if chunk_bytes is not None:
+            total += size(row)
+
+        if len(rows) >= chunk_size or \
+                (chunk_bytes is not None and total >= chunk_bytes):
+            yield rows
+            rows = []
+            total = 0
+
+    if rows:
+        yield rows
+
+
+def _waveplot_size(row):
+    return WAVEPLOT_DTYPE.itemsize + len(row.full)
+
+
+def _fixed(value, length):
+    """Converts a binary value to an array of exactly length bytes, padded
+    with zeros.
+    """
+
+    array = numpy.zeros(length, dtype=numpy.uint8)
+    if value is not None:
+        value = numpy.frombuffer(bytes(value), dtype=numpy.uint8)[:length]
+        array[:len(value)] = value
+    return array
+
+
+def _encode(row, name):
+    """Encodes a text column of a WavePlot, raising ValueError if it's too
+    long for its field, rather than letting numpy truncate it.
+    """
+
+    value = getattr(row, name).encode('utf-8')
+    length = WAVEPLOT_DTYPE.fields[name][0].itemsize
+    if len(value) > length:
+        raise ValueError("The {} of WavePlot {} is longer than {} "
+                         "bytes".format(name, row.gid, length))
+    return value
+
+
+def _waveplot_record(row):
+    return (
+        _fixed(row.gid.bytes, 16), row.duration.total_seconds(),
+        _encode(row, 'source_type'), row.sample_rate or 0,
+        row.bit_depth or 0, row.bit_rate or 0, row.num_channels,
+        row.dr_level, _fixed(row.image_hash, 20), row.sonic_hash,
+        _encode(row, 'version'), _fixed(row.thumbnail, 50)
+    )
+
+
+def _context_record(row):
+    return (
+        row.id, _fixed(row.waveplot_gid.bytes, 16),
+        _fixed(row.release_gid.bytes, 16),
+        _fixed(row.recording_gid.bytes, 16),
+        _fixed(row.track_gid.bytes, 16), row.artist_credit_id
+    )
+
+
+def _save(path, array):
+    """Saves an array to a .npy file, atomically."""
+
+    descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(descriptor, 'wb') as output:
+        numpy.save(output, array)
+    os.rename(temp_path, path)
+
+
+def _write_parquet(path, columns, types):
+    schema = pyarrow.schema([(name, getattr(pyarrow, type_name)())
+                             for name, type_name in types])
+
+    descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    os.close(descriptor)
+    pyarrow.parquet.write_table(pyarrow.table(columns, schema=schema),
+                                temp_path)
+    os.rename(temp_path, path)
+
+
+def _chunk_name(table, index):
+    return '{}-{:05d}'.format(table, index)
+
+
+def _write_waveplot_chunk(directory, name, rows, file_format):
+    if file_format == FORMAT_PARQUET:
+        _write_parquet(os.path.join(directory, name + '.parquet'), {
+            'gid': [row.gid.bytes for row in rows],
+            'duration': [row.duration.total_seconds() for row in rows],
+            'source_type': [row.source_type for row in rows],
+            'sample_rate': [row.sample_rate for row in rows],
+            'bit_depth': [row.bit_depth for row in rows],
+            'bit_rate': [row.bit_rate for row in rows],
+            'num_channels': [row.num_channels for row in rows],
+            'dr_level': [row.dr_level for row in rows],
+            'image_hash': [bytes(row.image_hash) for row in rows],
+            'sonic_hash': [row.sonic_hash for row in rows],
+            'version': [row.version for row in rows],
+            'thumbnail': [bytes(row.thumbnail) for row in rows],
+            'full': [bytes(row.full) for row in rows],
+        }, WAVEPLOT_PARQUET_TYPES)
+        return
+
+    records = numpy.array([_waveplot_record(row) for row in rows],
+                          dtype=WAVEPLOT_DTYPE)
+
+    offsets = numpy.zeros(len(rows) + 1, dtype=numpy.int64)
+    offsets[1:] = numpy.cumsum([len(row.full) for row in rows])
+
+    full = numpy.empty(offsets[-1], dtype=numpy.uint8)
+    for index, row in enumerate(rows):
+        full[offsets[index]:offsets[index + 1]] = numpy.frombuffer(
+            bytes(row.full), dtype=numpy.uint8
+        )
+
+    _save(os.path.join(directory, name + '.records.npy'), records)
+    _save(os.path.join(directory, name + '.offsets.npy'), offsets)
+    _save(os.path.join(directory, name + '.full.npy'), full)
+
+
+def _write_context_chunk(directory, name, rows, file_format):
+    if file_format == FORMAT_PARQUET:
+        _write_parquet(os.path.join(directory, name + '.parquet'), {
+            'id': [row.id for row in rows],
+            'waveplot_gid': [row.waveplot_gid.bytes for row in rows],
+            'release_gid': [row.release_gid.bytes for row in rows],
+            'recording_gid': [row.recording_gid.bytes for row in rows],
+            'track_gid': [row.track_gid.bytes for row in rows],
+            'artist_credit_id': [row.artist_credit_id for row in rows],
+        }, CONTEXT_PARQUET_TYPES)
+        return
+
+    records = numpy.array([_context_record(row) for row in rows],
+                          dtype=CONTEXT_DTYPE)
+    _save(os.path.join(directory, name + '.records.npy'), records)
+
+
+def export(engine, directory, file_format=FORMAT_NPY,
+           chunk_size=DEFAULT_CHUNK_SIZE, waveplots=True, contexts=True,
+           chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """Exports the waveplot table, with full waveforms, and the
+    waveplot_context table to chunked files in directory, which is created
+    if necessary. Chunks have at most chunk_size rows, and a chunk of
+    WavePlots ends once it reaches chunk_bytes. Each table is read in a
+    single transaction, so each is exported as a consistent snapshot.
+    Returns the manifest, which is also written to the directory. Raises
+    ValueError if a text value is too long for the npy format.
+    """
+
+    if file_format not in FORMATS:
+        raise ValueError("Unknown export format {!r}".format(file_format))
+
+    if file_format == FORMAT_PARQUET and pyarrow is None:
+        raise ValueError("The parquet format requires pyarrow")
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'format': file_format,
+        'tables': {},
+    }
+
+    exports = []
+    if waveplots:
+        exports.append(('waveplot', select(_WAVEPLOT_COLUMNS + [
+            WavePlotData.full
+        ]).select_from(
+            WavePlot.__table__.join(WavePlotData.__table__)
+        ).order_by(WavePlot.gid), {
+            'fetch_size': min(chunk_size, _WAVEPLOT_FETCH_SIZE),
+            'chunk_bytes': chunk_bytes, 'size': _waveplot_size
+        }, _write_waveplot_chunk))
+
+    if contexts:
+        exports.append(('waveplot_context', select(
+            _CONTEXT_COLUMNS
+        ).order_by(WavePlotContext.id), {
+            'fetch_size': chunk_size
+        }, _write_context_chunk))
+
+    for table, statement, stream_options, write_chunk in exports:
+        chunks = []
+        with engine.connect() as connection:
+            with connection.begin():
+                for rows in _stream(connection, statement, chunk_size,
+                                    **stream_options):
+                    name = _chunk_name(table, len(chunks))
+                    write_chunk(directory, name, rows, file_format)
+                    chunks.append({'name': name, 'rows': len(rows)})
+
+        manifest['tables'][table] = chunks
+
+    descriptor, temp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(descriptor, 'w') as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+    os.rename(temp_path, os.path.join(directory, MANIFEST))
+
+    return manifest
+
+
+class WavePlotChunk(object):
+    """A chunk of WavePlots exported in the npy format, memory mapped.
+
+    records is a structured array with WAVEPLOT_DTYPE, and full(index)
+    returns the full waveform of a WavePlot as a read-only view into the
+    memory mapped full file.
+    """
+
+    def __init__(self, directory, name):
+        path = os.path.join(directory, name)
+        self.records = numpy.load(path + '.records.npy', mmap_mode='r')
+        self.offsets = numpy.load(path + '.offsets.npy', mmap_mode='r')
+        self.waveforms = numpy.load(path + '.full.npy', mmap_mode='r')
+
+    def __len__(self):
+        return len(self.records)
+
+    def full(self, index):
+        return self.waveforms[self.offsets[index]:self.offsets[index + 1]]
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as manifest:
+        return json.load(manifest)
+
+
+def waveplot_chunks(directory):
+    """Yields a WavePlotChunk for each chunk of an npy format export."""
+
+    manifest = read_manifest(directory)
+    if manifest['format'] != FORMAT_NPY:
+        raise ValueError("Only npy format exports can be memory mapped")
+
+    for chunk in manifest['tables'].get('waveplot', []):
+        yield WavePlotChunk(directory, chunk['name'])
+
+
+def context_chunks(directory):
+    """Yields the memory mapped records of each chunk of contexts in an npy
+    format export.
+    """
+
+    manifest = read_manifest(directory)
+    if manifest['format'] != FORMAT_NPY:
+        raise ValueError("Only npy format exports can be memory mapped")
+
+    for chunk in manifest['tables'].get('waveplot_context', []):
+        yield numpy.load(os.path.join(directory, chunk['name'] +
+                                      '.records.npy'), mmap_mode='r')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Export WavePlots and contexts to columnar files.'
+    )
+    parser.add_argument('directory')
+    parser.add_argument('--database', required=True,
+                        help='SQLAlchemy URL of the WavePlot database')
+    parser.add_argument('--format', dest='file_format', choices=FORMATS,
+                        default=FORMAT_NPY)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='rows per file (default: %(default)s)')
+    parser.add_argument('--chunk-bytes', type=int,
+                        default=DEFAULT_CHUNK_BYTES,
+                        help='approximate bytes per file of WavePlots '
+                             '(default: %(default)s)')
+    parser.add_argument('--no-waveplots', action='store_true')
+    parser.add_argument('--no-contexts', action='store_true')
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.database)
+    try:
+        manifest = export(engine, args.directory, args.file_format,
+                          args.chunk_size, not args.no_waveplots,
+                          not args.no_contexts, args.chunk_bytes)
+    except ValueError as e:
+        sys.stderr.write('Error: {}\n'.format(e))
+        return 1
+
+    for table, chunks in sorted(manifest['tables'].items()):
+        sys.stderr.write('{}: {} rows in {} chunks\n'.format(
+            table, sum(chunk['rows'] for chunk in chunks), len(chunks)
+        ))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
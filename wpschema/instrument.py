@@ -0,0 +1,342 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module provides optional instrumentation of database access through
+the wpschema models, recording which models and relationships cause queries,
+how long the queries take, how many rows are loaded and how many bytes of
+BYTEA data, such as WavePlot.full, are fetched.
+
+Collected metrics are passed to sinks, which are callables taking a Metrics
+object, when Instrumentation.report is called. Sinks are passed the metrics
+collected since the last reset or, if their cumulative attribute is True,
+those collected since instrumentation started, as Prometheus expects:
+
+    instrumentation = Instrumentation([LoggingSink()])
+    instrumentation.attach(engine)
+    ...
+    instrumentation.report()
+"""
+
+import bisect
+import copy
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import BYTEA
+from sqlalchemy.orm import Session
+
+from wpschema.base import Base
+
+# Upper bounds of the query latency histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0)
+
+_LABEL_OPTION = 'wpschema_instrument_label'
+
+
+class Histogram(object):
+    """A histogram of observed values, with cumulative counts for each
+    bucket upper bound, in the style of Prometheus.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        """Adds the observations of another histogram with the same
+        buckets.
+        """
+
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+    def cumulative(self):
+        """Returns a list of (upper bound, count) tuples, ending with an
+        infinite upper bound.
+        """
+
+        result = []
+        total = 0
+        for bound, count in zip(list(self.buckets) + [float('inf')],
+                                self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics(object):
+    """Metrics collected by Instrumentation.
+
+    Queries and latencies are keyed by label, which is the name of the
+    queried model (for example 'Release'), the relationship or deferred
+    column being loaded (for example 'Release.status'), or 'sql' for
+    statements not made through the ORM. Rows are keyed by model name, and
+    bytes by BYTEA attribute (for example 'WavePlotData.full').
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.queries = {}
+        self.latency = {}
+        self.rows = {}
+        self.bytes = {}
+
+    def record_query(self, label, seconds):
+        self.queries[label] = self.queries.get(label, 0) + 1
+        if label not in self.latency:
+            self.latency[label] = Histogram(self.buckets)
+        self.latency[label].observe(seconds)
+
+    def record_row(self, model):
+        self.rows[model] = self.rows.get(model, 0) + 1
+
+    def record_bytes(self, attribute, size):
+        self.bytes[attribute] = self.bytes.get(attribute, 0) + size
+
+    def merge(self, other):
+        """Adds the metrics collected by another Metrics object."""
+
+        for label, count in other.queries.items():
+            self.queries[label] = self.queries.get(label, 0) + count
+        for label, latency in other.latency.items():
+            if label not in self.latency:
+                self.latency[label] = Histogram(self.buckets)
+            self.latency[label].merge(latency)
+        for model, count in other.rows.items():
+            self.rows[model] = self.rows.get(model, 0) + count
+        for attribute, size in other.bytes.items():
+            self.bytes[attribute] = self.bytes.get(attribute, 0) + size
+
+
+class Instrumentation(object):
+    """Collects Metrics from an engine and the sessions using it."""
+
+    def __init__(self, sinks=(), buckets=DEFAULT_BUCKETS):
+        self.sinks = list(sinks)
+        self.buckets = buckets
+        self.metrics = Metrics(buckets)
+        self.totals = Metrics(buckets)
+        self.lock = threading.Lock()
+
+        self._bytea_attributes = {}
+        self._targets = []
+
+    def attach(self, engine, session_target=Session):
+        """Starts collecting metrics for engine. ORM queries are labelled
+        for sessions created by session_target, which may be a Session
+        class, sessionmaker or Session.
+        """
+
+        self._listen(engine, 'before_cursor_execute', self._before_execute)
+        self._listen(engine, 'after_cursor_execute', self._after_execute)
+        self._listen(session_target, 'do_orm_execute', self._label)
+
+        if not any(target is Base for target, _, _ in self._targets):
+            self._listen(Base, 'load', self._loaded, propagate=True)
+            self._listen(Base, 'refresh', self._refreshed, propagate=True)
+
+    def detach(self):
+        """Stops collecting metrics."""
+
+        for target, name, listener in self._targets:
+            event.remove(target, name, listener)
+        self._targets = []
+
+    def _listen(self, target, name, listener, **kwargs):
+        event.listen(target, name, listener, **kwargs)
+        self._targets.append((target, name, listener))
+
+    def report(self, reset=True):
+        """Passes the metrics collected so far to each sink and, if reset is
+        True, starts collecting new metrics. Cumulative sinks are passed all
+        metrics collected since instrumentation started instead.
+        """
+
+        with self.lock:
+            metrics = self.metrics
+            if reset:
+                self.metrics = Metrics(self.buckets)
+                self.totals.merge(metrics)
+            else:
+                metrics = copy.deepcopy(metrics)
+
+            totals = None
+            if any(getattr(sink, 'cumulative', False) for sink in self.sinks):
+                totals = copy.deepcopy(self.totals)
+                if not reset:
+                    totals.merge(metrics)
+
+        for sink in self.sinks:
+            sink(totals if getattr(sink, 'cumulative', False) else metrics)
+
+        return metrics
+
+    def _label(self, orm_execute_state):
+        if orm_execute_state.is_relationship_load:
+            label = str(orm_execute_state.loader_strategy_path[-1])
+        else:
+            mapper = orm_execute_state.bind_arguments.get('mapper')
+            label = 'sql' if mapper is None else mapper.class_.__name__
+
+        orm_execute_state.update_execution_options(**{_LABEL_OPTION: label})
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        conn.info.setdefault(_LABEL_OPTION, []).append(time.time())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        seconds = time.time() - conn.info[_LABEL_OPTION].pop()
+        label = context.execution_options.get(_LABEL_OPTION, 'sql')
+
+        with self.lock:
+            self.metrics.record_query(label, seconds)
+
+    def _bytea_keys(self, mapper):
+        keys = self._bytea_attributes.get(mapper)
+        if keys is None:
+            keys = [prop.key for prop in mapper.column_attrs
+                    if any(isinstance(column.type, BYTEA)
+                           for column in prop.columns)]
+            self._bytea_attributes[mapper] = keys
+        return keys
+
+    def _record_bytes(self, instance, keys):
+        name = type(instance).__name__
+        for key in keys:
+            value = instance.__dict__.get(key)
+            if value is not None:
+                self.metrics.record_bytes(name + '.' + key, len(value))
+
+    def _loaded(self, instance, context):
+        keys = self._bytea_keys(type(instance).__mapper__)
+
+        with self.lock:
+            self.metrics.record_row(type(instance).__name__)
+            self._record_bytes(instance, keys)
+
+    def _refreshed(self, instance, context, attrs):
+        keys = self._bytea_keys(type(instance).__mapper__)
+        if attrs is not None:
+            keys = [key for key in keys if key in attrs]
+
+        with self.lock:
+            self._record_bytes(instance, keys)
+
+
+class LoggingSink(object):
+    """Logs a summary of each report."""
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('wpschema.instrument')
+        self.level = level
+
+    def __call__(self, metrics):
+        for label in sorted(metrics.queries):
+            latency = metrics.latency[label]
+            self.logger.log(
+                self.level, '%s: %d queries, %.1f ms total', label,
+                metrics.queries[label], latency.sum * 1000.0
+            )
+
+        for model in sorted(metrics.rows):
+            self.logger.log(self.level, '%s: %d rows loaded', model,
+                            metrics.rows[model])
+
+        for attribute in sorted(metrics.bytes):
+            self.logger.log(self.level, '%s: %d bytes fetched', attribute,
+                            metrics.bytes[attribute])
+
+
+def prometheus_text(metrics, prefix='wpschema'):
+    """Returns the metrics in the Prometheus text exposition format."""
+
+    lines = [
+        '# TYPE {}_queries_total counter'.format(prefix),
+    ]
+    for label in sorted(metrics.queries):
+        lines.append('{}_queries_total{{label="{}"}} {}'.format(
+            prefix, label, metrics.queries[label]
+        ))
+
+    lines.append('# TYPE {}_query_seconds histogram'.format(prefix))
+    for label in sorted(metrics.latency):
+        latency = metrics.latency[label]
+        for bound, count in latency.cumulative():
+            lines.append('{}_query_seconds_bucket{{label="{}",le="{}"}} {}'
+                         .format(prefix, label, '+Inf' if bound == float('inf')
+                                 else bound, count))
+        lines.append('{}_query_seconds_sum{{label="{}"}} {}'.format(
+            prefix, label, latency.sum
+        ))
+        lines.append('{}_query_seconds_count{{label="{}"}} {}'.format(
+            prefix, label, latency.count
+        ))
+
+    lines.append('# TYPE {}_rows_loaded_total counter'.format(prefix))
+    for model in sorted(metrics.rows):
+        lines.append('{}_rows_loaded_total{{model="{}"}} {}'.format(
+            prefix, model, metrics.rows[model]
+        ))
+
+    lines.append('# TYPE {}_bytea_bytes_total counter'.format(prefix))
+    for attribute in sorted(metrics.bytes):
+        lines.append('{}_bytea_bytes_total{{attribute="{}"}} {}'.format(
+            prefix, attribute, metrics.bytes[attribute]
+        ))
+
+    return '\n'.join(lines) + '\n'
+
+
+class PrometheusSink(object):
+    """Writes each report to a file in the Prometheus text exposition
+    format, for example for the node exporter's textfile collector. The
+    counters and histograms are cumulative, whether or not reports reset
+    the metrics.
+    """
+
+    cumulative = True
+
+    def __init__(self, path, prefix='wpschema'):
+        self.path = path
+        self.prefix = prefix
+
+    def __call__(self, metrics):
+        with open(self.path, 'w') as output:
+            output.write(prometheus_text(metrics, self.prefix))
+
+
+class CallbackSink(object):
+    """Passes each report to a callback."""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def __call__(self, metrics):
+        self.callback(metrics)
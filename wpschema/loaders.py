@@ -0,0 +1,103 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module provides eager loading presets for the MusicBrainz models, so
+that each page loads everything it displays in a fixed number of queries.
+
+Many-to-one relationships are joined into the parent query, while
+one-to-many relationships are loaded with one extra SELECT ... IN query per
+level, to avoid multiplying rows.
+"""
+
+from sqlalchemy.orm import joinedload, selectinload
+
+from wpschema.musicbrainz import (Area, Artist, Medium, Recording, Release,
+                                  ReleaseGroup, Track)
+
+
+def release_options():
+    """Loads a release with its release group, status, packaging, language,
+    script and artist credit, and its media, tracks, recordings and track
+    artist credits, in three queries.
+    """
+
+    return [
+        joinedload(Release.artist_credit),
+        joinedload(Release.release_group).joinedload(ReleaseGroup.type),
+        joinedload(Release.status),
+        joinedload(Release.packaging),
+        joinedload(Release.language),
+        joinedload(Release.script),
+        selectinload(Release.media).selectinload(Medium.tracks).options(
+            joinedload(Track.recording),
+            joinedload(Track.artist_credit)
+        ),
+    ]
+
+
+def track_options():
+    """Loads a track with its artist credit, its recording and the
+    recording's artist credit, and its medium, release and release group,
+    in one query.
+    """
+
+    return [
+        joinedload(Track.artist_credit),
+        joinedload(Track.recording).joinedload(Recording.artist_credit),
+        joinedload(Track.medium).joinedload(Medium.release).options(
+            joinedload(Release.artist_credit),
+            joinedload(Release.release_group)
+        ),
+    ]
+
+
+def artist_options():
+    """Loads an artist with its type, gender and areas, in one query."""
+
+    return [
+        joinedload(Artist.type),
+        joinedload(Artist.gender),
+        joinedload(Artist.area).joinedload(Area.type),
+        joinedload(Artist.begin_area),
+        joinedload(Artist.end_area),
+    ]
+
+
+PRESETS = {
+    'release': (Release, release_options),
+    'track': (Track, track_options),
+    'artist': (Artist, artist_options),
+}
+
+
+def query(session, preset):
+    """Returns a query for the model of the named preset, with the preset's
+    loader options applied.
+    """
+
+    model, options = PRESETS[preset]
+    return session.query(model).options(*options())
+
+
+def get_by_gid(session, preset, gid):
+    """Returns the entity of the named preset with the provided gid, or None
+    if there isn't one.
+    """
+
+    model, _ = PRESETS[preset]
+    return query(session, preset).filter(model.gid == gid).one_or_none()
@@ -0,0 +1,94 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module provides a process-wide cache of the small, rarely changing
+MusicBrainz lookup tables, such as ReleaseStatus and Language.
+
+Once installed on a Session class or sessionmaker, lazy loads of
+relationships to these tables, like Release.status or Artist.type, are
+answered from the cache without querying the database.
+"""
+
+from sqlalchemy import event
+from sqlalchemy.engine.result import IteratorResult, SimpleResultMetaData
+from sqlalchemy.orm.interfaces import MANYTOONE
+
+from wpschema.musicbrainz import (AreaType, ArtistType, Gender, Language,
+                                  ReleaseGroupPrimaryType, ReleasePackaging,
+                                  ReleaseStatus, Script)
+
+LOOKUP_MODELS = (
+    AreaType, ArtistType, Gender, Language, ReleaseGroupPrimaryType,
+    ReleasePackaging, ReleaseStatus, Script
+)
+
+
+class LookupCache(object):
+    """Holds every row of each lookup model, as detached instances."""
+
+    def __init__(self, models=LOOKUP_MODELS):
+        self.models = models
+        self.rows = {}
+
+    def refresh(self, session):
+        """Loads every row of the lookup tables using the provided session,
+        replacing any previously cached rows. Call this at startup, and
+        again whenever replication may have changed the tables.
+        """
+
+        rows = {}
+        for model in self.models:
+            instances = session.query(model).all()
+            for instance in instances:
+                session.expunge(instance)
+            rows[model] = dict((instance.id, instance)
+                               for instance in instances)
+
+        # Replace all rows at once, so other threads never see a mixture.
+        self.rows = rows
+
+    def install(self, target):
+        """Answers lazy loads from the cache in sessions created by target,
+        which may be a Session class, sessionmaker or Session.
+        """
+        event.listen(target, 'do_orm_execute', self._load)
+
+    def uninstall(self, target):
+        event.remove(target, 'do_orm_execute', self._load)
+
+    def _load(self, orm_execute_state):
+        if not orm_execute_state.is_relationship_load:
+            return None
+
+        mapper = orm_execute_state.bind_arguments.get('mapper')
+        rows = self.rows.get(getattr(mapper, 'class_', None))
+        if rows is None:
+            return None
+
+        prop = orm_execute_state.loader_strategy_path[-1]
+        parameters = orm_execute_state.parameters
+        if prop.direction is not MANYTOONE or len(parameters) != 1:
+            return None
+
+        instance = rows.get(list(parameters.values())[0])
+        if instance is None:
+            return None
+
+        instance = orm_execute_state.session.merge(instance, load=False)
+        return IteratorResult(SimpleResultMetaData(['instance']),
+                              iter([(instance,)]))
@@ -0,0 +1,191 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module provides similarity matching of WavePlots, using the 16-bit
+sonic hash to find candidates and the full waveform to rank them.
+
+Because the sonic hash space only has 65536 values, every hash within a small
+Hamming radius can be enumerated directly (137 values for a radius of 2). The
+candidate lookups below probe that set against either an in-memory bucket
+table or the sonic hash index on the waveplot table, so the number of rows
+touched depends on the number of near neighbours rather than the table size.
+"""
+
+import datetime
+import itertools
+
+from wpschema.waveplot import WavePlot, load_profile
+
+SONIC_HASH_BITS = 16
+
+DEFAULT_RADIUS = 2
+DEFAULT_DURATION_TOLERANCE = 5
+
+
+def hamming_distance(first, second):
+    """Returns the number of bits which differ between two sonic hashes."""
+    return bin(first ^ second).count('1')
+
+
+def hash_neighbours(sonic_hash, radius=DEFAULT_RADIUS):
+    """Returns a list of all sonic hashes within the given Hamming radius of
+    sonic_hash, including sonic_hash itself.
+    """
+
+    result = [sonic_hash]
+    for distance in range(1, radius + 1):
+        for bits in itertools.combinations(range(SONIC_HASH_BITS), distance):
+            mask = 0
+            for bit in bits:
+                mask |= 1 << bit
+            result.append(sonic_hash ^ mask)
+
+    return result
+
+
+def duration_seconds(duration):
+    """Converts a duration, stored either as an Interval (timedelta) or a
+    number of seconds, into a number of seconds.
+    """
+
+    if isinstance(duration, datetime.timedelta):
+        return duration.total_seconds()
+    return duration
+
+
+def waveform_distance(first, second):
+    """Compares two full waveforms, returning a value between 0.0 (identical)
+    and 1.0 (completely different).
+
+    The waveforms are compared over their common length, and each missing
+    sample in the shorter waveform counts as a maximal difference.
+    """
+
+    first = bytearray(first)
+    second = bytearray(second)
+
+    length = max(len(first), len(second))
+    if length == 0:
+        return 0.0
+
+    common = min(len(first), len(second))
+    total = sum(abs(a - b) for a, b in zip(first[:common], second[:common]))
+    total += 200 * (length - common)
+
+    return min(1.0, total / (200.0 * length))
+
+
+class SonicHashIndex(object):
+    """An in-memory index of WavePlots, bucketed by sonic hash.
+
+    Any object with sonic_hash, duration and num_channels attributes can be
+    added, so both wpschema.waveplot.WavePlot rows and
+    wpschema._waveplot.WavePlot objects may be indexed.
+    """
+
+    def __init__(self, waveplots=None):
+        self.buckets = {}
+
+        for waveplot in waveplots or []:
+            self.add(waveplot)
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def add(self, waveplot):
+        self.buckets.setdefault(waveplot.sonic_hash, []).append(waveplot)
+
+    def remove(self, waveplot):
+        bucket = self.buckets.get(waveplot.sonic_hash, [])
+        if waveplot in bucket:
+            bucket.remove(waveplot)
+            if not bucket:
+                del self.buckets[waveplot.sonic_hash]
+
+    def candidates(self, sonic_hash, duration, num_channels,
+                   radius=DEFAULT_RADIUS,
+                   duration_tolerance=DEFAULT_DURATION_TOLERANCE):
+        """Returns all indexed WavePlots within radius bits of sonic_hash
+        which have the same number of channels and a duration within
+        duration_tolerance seconds.
+        """
+
+        duration = duration_seconds(duration)
+
+        result = []
+        for neighbour in hash_neighbours(sonic_hash, radius):
+            for waveplot in self.buckets.get(neighbour, []):
+                if waveplot.num_channels != num_channels:
+                    continue
+
+                difference = duration - duration_seconds(waveplot.duration)
+                if abs(difference) <= duration_tolerance:
+                    result.append(waveplot)
+
+        return result
+
+
+def candidate_query(session, sonic_hash, duration, num_channels,
+                    radius=DEFAULT_RADIUS,
+                    duration_tolerance=DEFAULT_DURATION_TOLERANCE):
+    """Returns a query for WavePlots within radius bits of sonic_hash, with
+    the same number of channels and a similar duration. The query is
+    answered from the sonic hash index on the waveplot table.
+    """
+
+    duration = datetime.timedelta(seconds=duration_seconds(duration))
+    tolerance = datetime.timedelta(seconds=duration_tolerance)
+
+    return session.query(WavePlot).filter(
+        WavePlot.sonic_hash.in_(hash_neighbours(sonic_hash, radius)),
+        WavePlot.num_channels == num_channels,
+        WavePlot.duration.between(duration - tolerance, duration + tolerance)
+    )
+
+
+def rank(full, candidates, max_distance=None):
+    """Ranks candidates by the distance between their full waveforms and the
+    provided full waveform. Returns a list of (distance, candidate) tuples,
+    closest first, omitting any candidate further than max_distance.
+    """
+
+    result = []
+    for candidate in candidates:
+        distance = waveform_distance(full, candidate.full)
+        if max_distance is None or distance <= max_distance:
+            result.append((distance, candidate))
+
+    result.sort(key=lambda item: item[0])
+    return result
+
+
+def match(session, waveplot, radius=DEFAULT_RADIUS,
+          duration_tolerance=DEFAULT_DURATION_TOLERANCE, max_distance=None):
+    """Finds WavePlots in the database which are similar to waveplot,
+    returning a list of (distance, WavePlot) tuples, closest first.
+    """
+
+    candidates = candidate_query(
+        session, waveplot.sonic_hash, waveplot.duration,
+        waveplot.num_channels, radius, duration_tolerance
+    ).options(*load_profile('full'))
+
+    if waveplot.gid is not None:
+        candidates = candidates.filter(WavePlot.gid != waveplot.gid)
+
+    return rank(waveplot.full, candidates, max_distance)
@@ -0,0 +1,250 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module provides migrations of existing databases to changes in the
+schema defined by the wpschema models.
+"""
+
+import uuid
+
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import text as sql_text
+
+from wpschema.waveplot import WavePlotData
+
+DEFAULT_BATCH_SIZE = 1000
+
+# The name PostgreSQL gives the unique constraint on waveplot.image_hash
+# when the table is created from the models.
+IMAGE_HASH_CONSTRAINT = 'waveplot_image_hash_key'
+
+_FIND_CONSTRAINT = sql_text("""
+    SELECT 1 FROM pg_constraint
+    JOIN pg_namespace ON pg_namespace.oid = pg_constraint.connamespace
+    WHERE pg_namespace.nspname = 'waveplot' AND conname = :name
+""")
+
+# Maps each WavePlot sharing its image_hash with another to the WavePlot
+# kept in its place: the one uploaded first, or with the lowest gid if
+# there are no upload edits.
+_FIND_DUPLICATE_WAVEPLOTS = sql_text("""
+    CREATE TEMPORARY TABLE waveplot_duplicate ON COMMIT DROP AS
+    SELECT gid, keep_gid FROM (
+        SELECT w.gid, first_value(w.gid) OVER (
+            PARTITION BY w.image_hash
+            ORDER BY (
+                SELECT min(e.time) FROM waveplot.edit AS e
+                WHERE e.waveplot_gid = w.gid
+            ) NULLS LAST, w.gid
+        ) AS keep_gid
+        FROM waveplot.waveplot AS w
+        WHERE w.image_hash IN (
+            SELECT image_hash FROM waveplot.waveplot
+            GROUP BY image_hash HAVING count(*) > 1
+        )
+    ) AS duplicate
+    WHERE gid <> keep_gid
+""")
+
+# Tables referring to WavePlots by gid, whose references to duplicates are
+# moved to the WavePlot kept.
+_WAVEPLOT_REFERENCES = [
+    ('waveplot.waveplot_context', 'waveplot_gid'),
+    ('waveplot.waveplot_context_summary', 'waveplot_gid'),
+    ('waveplot.edit', 'waveplot_gid'),
+]
+
+# Indexes used by incremental refreshes of the context summary, as (name,
+# table, column): one on last_updated for each summarised entity, and those
+# used to follow it to the affected contexts. The latter have the names of
+# the MusicBrainz schema's own indexes, so aren't duplicated.
+_SUMMARY_REFRESH_INDEXES = [
+    ('track_idx_last_updated', 'track', 'last_updated'),
+    ('medium_idx_last_updated', 'medium', 'last_updated'),
+    ('release_idx_last_updated', 'release', 'last_updated'),
+    ('release_group_idx_last_updated', 'release_group', 'last_updated'),
+    ('recording_idx_last_updated', 'recording', 'last_updated'),
+    ('artist_credit_idx_last_updated', 'artist_credit', 'last_updated'),
+    ('track_idx_medium', 'track', 'medium'),
+    ('track_idx_recording', 'track', 'recording'),
+    ('medium_idx_release', 'medium', 'release'),
+    ('release_idx_release_group', 'release', 'release_group'),
+]
+
+_ARTIST_CREDIT_LAST_UPDATED = [
+    "ALTER TABLE musicbrainz.artist_credit "
+    "ADD COLUMN IF NOT EXISTS last_updated TIMESTAMP WITH TIME ZONE "
+    "DEFAULT now()",
+    """
+    CREATE OR REPLACE FUNCTION waveplot.artist_credit_last_updated()
+    RETURNS trigger AS $$
+    BEGIN
+        NEW.last_updated = now();
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS artist_credit_last_updated "
+    "ON musicbrainz.artist_credit",
+    "CREATE TRIGGER artist_credit_last_updated "
+    "BEFORE UPDATE OF name ON musicbrainz.artist_credit "
+    "FOR EACH ROW EXECUTE PROCEDURE waveplot.artist_credit_last_updated()",
+]
+
+_COPY_WAVEPLOT_DATA_BATCH = sql_text("""
+    WITH batch AS (
+        SELECT gid, "full" FROM waveplot.waveplot
+        WHERE gid > :last_gid ORDER BY gid LIMIT :batch_size
+    ), copied AS (
+        INSERT INTO waveplot.waveplot_data (gid, "full")
+        SELECT gid, "full" FROM batch
+        ON CONFLICT (gid) DO NOTHING
+    )
+    SELECT gid FROM batch ORDER BY gid DESC LIMIT 1
+""").bindparams(
+    bindparam('last_gid', type_=UUID(as_uuid=True))
+).columns(gid=UUID(as_uuid=True))
+
+_COPY_WAVEPLOT_DATA_REMAINING = sql_text("""
+    INSERT INTO waveplot.waveplot_data (gid, "full")
+    SELECT w.gid, w."full" FROM waveplot.waveplot AS w
+    LEFT JOIN waveplot.waveplot_data AS d ON d.gid = w.gid
+    WHERE d.gid IS NULL
+""")
+
+
+def split_waveplot_data(engine, batch_size=DEFAULT_BATCH_SIZE,
+                        drop_column=True):
+    """Moves the full waveform of each WavePlot from the full column of the
+    waveplot table, as used by earlier versions of the schema, into the
+    waveplot_data table.
+
+    Rows are copied in batches ordered by gid, each in its own transaction,
+    so the migration can be interrupted and run again, continuing after the
+    last gid copied. Finally, any rows added during the migration are copied
+    and, if drop_column is True, the old column is dropped, with the
+    waveplot table locked against writes.
+    """
+
+    WavePlotData.__table__.create(engine, checkfirst=True)
+
+    # Until the column is dropped, only this migration writes to
+    # waveplot_data, so its greatest gid is where the previous run stopped.
+    with engine.connect() as connection:
+        last_gid = connection.execute(
+            select([func.max(WavePlotData.gid)])
+        ).scalar()
+    if last_gid is None:
+        last_gid = uuid.UUID(int=0)
+
+    while last_gid is not None:
+        with engine.begin() as connection:
+            last_gid = connection.execute(
+                _COPY_WAVEPLOT_DATA_BATCH,
+                {'last_gid': last_gid, 'batch_size': batch_size}
+            ).scalar()
+
+    with engine.begin() as connection:
+        connection.execute(sql_text(
+            "LOCK TABLE waveplot.waveplot IN EXCLUSIVE MODE"
+        ))
+        connection.execute(_COPY_WAVEPLOT_DATA_REMAINING)
+
+        if drop_column:
+            connection.execute(sql_text(
+                'ALTER TABLE waveplot.waveplot DROP COLUMN "full"'
+            ))
+
+
+def _table_exists(connection, name):
+    return connection.execute(
+        sql_text("SELECT to_regclass(:name) IS NOT NULL"), {'name': name}
+    ).scalar()
+
+
+def unique_image_hashes(engine):
+    """Adds the unique constraint on waveplot.image_hash, which
+    wpschema.bulk relies on, to databases created by earlier versions of the
+    schema.
+
+    WavePlots with the same image_hash are first merged into the one
+    uploaded first: contexts, summaries and edits of the others are moved to
+    it, and the others are deleted. This runs in one transaction, with the
+    waveplot table locked against writes. Returns the number of WavePlots
+    merged away, or None if the constraint already exists.
+    """
+
+    with engine.begin() as connection:
+        if connection.execute(_FIND_CONSTRAINT,
+                              {'name': IMAGE_HASH_CONSTRAINT}).scalar():
+            return None
+
+        connection.execute(sql_text(
+            "LOCK TABLE waveplot.waveplot IN SHARE ROW EXCLUSIVE MODE"
+        ))
+        connection.execute(_FIND_DUPLICATE_WAVEPLOTS)
+
+        for table, column in _WAVEPLOT_REFERENCES:
+            if _table_exists(connection, table):
+                connection.execute(sql_text(
+                    "UPDATE {0} SET {1} = d.keep_gid "
+                    "FROM waveplot_duplicate AS d "
+                    "WHERE {0}.{1} = d.gid".format(table, column)
+                ))
+
+        if _table_exists(connection, 'waveplot.waveplot_data'):
+            connection.execute(sql_text(
+                "DELETE FROM waveplot.waveplot_data AS data "
+                "USING waveplot_duplicate AS d WHERE data.gid = d.gid"
+            ))
+
+        merged = connection.execute(sql_text(
+            "DELETE FROM waveplot.waveplot AS w "
+            "USING waveplot_duplicate AS d WHERE w.gid = d.gid"
+        )).rowcount
+
+        connection.execute(sql_text(
+            "ALTER TABLE waveplot.waveplot "
+            "ADD CONSTRAINT {} UNIQUE (image_hash)".format(
+                IMAGE_HASH_CONSTRAINT
+            )
+        ))
+
+    return merged
+
+
+def prepare_summary_refresh(engine):
+    """Prepares the musicbrainz schema, which is created by MusicBrainz
+    rather than wpschema, for incremental refreshes of the context summary.
+
+    A last_updated column is added to artist_credit, with a trigger setting
+    it when a credit is renamed, and the indexes used to find the contexts
+    updated since a refresh are created. The tables are locked against
+    writes while the indexes are built. Running it again does nothing.
+    """
+
+    with engine.begin() as connection:
+        for statement in _ARTIST_CREDIT_LAST_UPDATED:
+            connection.execute(sql_text(statement))
+
+        for name, table, column in _SUMMARY_REFRESH_INDEXES:
+            connection.execute(sql_text(
+                "CREATE INDEX IF NOT EXISTS {} "
+                "ON musicbrainz.{} ({})".format(name, table, column)
+            ))
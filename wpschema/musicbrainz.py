@@ -25,7 +25,7 @@ import datetime
 from sqlalchemy import (Boolean, CHAR, Column, DateTime, ForeignKey, Integer,
                         SmallInteger, Unicode, UnicodeText)
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import backref, relationship
 
 from wpschema.base import Base
 
@@ -202,6 +202,11 @@ class ArtistCredit(Base):
 
     created = Column(DateTime(timezone=True), default=datetime.datetime.utcnow)
 
+    # Not in the MusicBrainz schema: added, along with a trigger keeping it
+    # up to date, by wpschema.migrate.prepare_summary_refresh.
+    last_updated = Column(DateTime(timezone=True),
+                          default=datetime.datetime.utcnow)
+
 
 class Release(Base):
 
@@ -385,7 +390,9 @@ class Medium(Base):
 
     track_count = Column(Integer, default=0, nullable=False)
 
-    release = relationship('Release', backref='media')
+    release = relationship(
+        'Release', backref=backref('media', order_by='Medium.position')
+    )
 
 
 class Track(Base):
@@ -418,7 +425,9 @@ class Track(Base):
 
     artist_credit = relationship('ArtistCredit')
     recording = relationship('Recording')
-    medium = relationship('Medium')
+    medium = relationship(
+        'Medium', backref=backref('tracks', order_by='Track.position')
+    )
 
 
 class TrackRedirect(Base):
@@ -0,0 +1,199 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module manages the monthly partitions of the edit table.
+
+Partitions are named edit_yYYYYmMM and cover a calendar month of edit times.
+Edits outside of them go to the default partition, edit_default, and are
+moved into a month's partition when it is created.
+
+ensure_edit_partitions should be run periodically (for example daily, from
+cron) so that partitions exist before edits are made in them, which keeps
+the default partition empty. Run as a script:
+
+    python -m wpschema.partition --database postgresql:///waveplot
+
+Old partitions can be detached with detach_edit_partitions, then archived or
+dropped.
+"""
+
+import argparse
+import datetime
+import re
+import sys
+
+from sqlalchemy import create_engine
+from sqlalchemy.sql import text as sql_text
+
+DEFAULT_MONTHS_AHEAD = 3
+
+_PARTITION_NAME = re.compile(r'^edit_y(\d{4})m(\d{2})$')
+
+_LIST_PARTITIONS = sql_text("""
+    SELECT child.relname FROM pg_inherits
+    JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent
+    JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+    JOIN pg_namespace ON pg_namespace.oid = parent.relnamespace
+    WHERE pg_namespace.nspname = 'waveplot' AND parent.relname = 'edit'
+""")
+
+
+_DEFAULT_HAS_EDITS = sql_text("""
+    SELECT EXISTS (SELECT 1 FROM waveplot.edit_default
+                   WHERE time >= :start AND time < :end)
+""")
+
+
+def _exists(connection, name):
+    return connection.execute(
+        sql_text("SELECT to_regclass(:name) IS NOT NULL"), {'name': name}
+    ).scalar()
+
+
+def _month_start(date):
+    return datetime.date(date.year, date.month, 1)
+
+
+def _next_month(month):
+    if month.month == 12:
+        return datetime.date(month.year + 1, 1, 1)
+    return datetime.date(month.year, month.month + 1, 1)
+
+
+def edit_partition_name(month):
+    """Returns the name of the partition holding edits made in the month of
+    the provided date.
+    """
+    return 'edit_y{:04d}m{:02d}'.format(month.year, month.month)
+
+
+def edit_partitions(connection):
+    """Returns a sorted list of (month, name) tuples for the existing monthly
+    partitions of the edit table.
+    """
+
+    result = []
+    for name, in connection.execute(_LIST_PARTITIONS):
+        match = _PARTITION_NAME.match(name)
+        if match is not None:
+            month = datetime.date(int(match.group(1)), int(match.group(2)), 1)
+            result.append((month, name))
+
+    result.sort()
+    return result
+
+
+def create_edit_partition(connection, month):
+    """Creates the partition for edits made in the month of the provided
+    date, if it doesn't already exist.
+
+    Edits of that month in the default partition are moved to the new
+    partition. The default partition is detached meanwhile, so the edit
+    table is locked against reads and writes until the transaction ends.
+    """
+
+    start = _month_start(month)
+    end = _next_month(start)
+    name = edit_partition_name(start)
+
+    if _exists(connection, 'waveplot.' + name):
+        return
+
+    moved = _exists(connection, 'waveplot.edit_default') and \
+        connection.execute(_DEFAULT_HAS_EDITS, {
+            'start': start, 'end': end
+        }).scalar()
+
+    # A partition can't be created while the default partition holds rows
+    # in its range.
+    if moved:
+        connection.execute(sql_text(
+            "ALTER TABLE waveplot.edit DETACH PARTITION waveplot.edit_default"
+        ))
+
+    connection.execute(sql_text(
+        "CREATE TABLE waveplot.{} PARTITION OF waveplot.edit "
+        "FOR VALUES FROM ('{}') TO ('{}')".format(
+            name, start.isoformat(), end.isoformat()
+        )
+    ))
+
+    if moved:
+        connection.execute(sql_text(
+            "WITH moved AS (DELETE FROM waveplot.edit_default "
+            "WHERE time >= :start AND time < :end RETURNING *) "
+            "INSERT INTO waveplot.{} SELECT * FROM moved".format(name)
+        ), {'start': start, 'end': end})
+        connection.execute(sql_text(
+            "ALTER TABLE waveplot.edit "
+            "ATTACH PARTITION waveplot.edit_default DEFAULT"
+        ))
+
+
+def ensure_edit_partitions(connection, months_ahead=DEFAULT_MONTHS_AHEAD,
+                           today=None):
+    """Creates partitions for the current month and the following
+    months_ahead months, where they don't already exist.
+    """
+
+    month = _month_start(today or datetime.datetime.utcnow().date())
+    for _ in range(months_ahead + 1):
+        create_edit_partition(connection, month)
+        month = _next_month(month)
+
+
+def detach_edit_partitions(connection, before):
+    """Detaches the partitions holding only edits made before the month of
+    the provided date. The detached tables are left in the waveplot schema,
+    and their names are returned so that they can be archived or dropped.
+    """
+
+    before = _month_start(before)
+
+    detached = []
+    for month, name in edit_partitions(connection):
+        if month < before:
+            connection.execute(sql_text(
+                "ALTER TABLE waveplot.edit "
+                "DETACH PARTITION waveplot.{}".format(name)
+            ))
+            detached.append(name)
+
+    return detached
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Create the monthly partitions of the edit table for '
+                    'the coming months.'
+    )
+    parser.add_argument('--database', required=True,
+                        help='SQLAlchemy URL of the WavePlot database')
+    parser.add_argument('--months-ahead', type=int,
+                        default=DEFAULT_MONTHS_AHEAD)
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.database)
+    with engine.begin() as connection:
+        ensure_edit_partitions(connection, args.months_ahead)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
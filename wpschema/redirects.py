@@ -0,0 +1,136 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module provides resolution of MusicBrainz identifiers, such as those
+stored in WavePlotContext, to the current identifier of the entity they refer
+to, following the gid redirect tables.
+"""
+
+import collections
+import time
+
+from wpschema.musicbrainz import (Recording, RecordingRedirect, Release,
+                                  ReleaseRedirect, Track, TrackRedirect)
+
+REDIRECTS = {
+    Recording: RecordingRedirect,
+    Release: ReleaseRedirect,
+    Track: TrackRedirect,
+}
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 3600
+
+
+class _LRUCache(object):
+    """A least recently used cache, in which entries also expire after ttl
+    seconds.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        """Returns a (found, value) tuple for the provided key."""
+
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False, None
+
+        expires, value = entry
+        if expires < time.time():
+            return False, None
+
+        self.entries[key] = entry
+        return True, value
+
+    def set(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = (time.time() + self.ttl, value)
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class GIDResolver(object):
+    """Resolves batches of MusicBrainz identifiers to the identifiers of the
+    entities they currently refer to. Each batch is resolved with a single
+    query per entity type, and recent resolutions are cached.
+    """
+
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE,
+                 cache_ttl=DEFAULT_CACHE_TTL):
+        self.cache = _LRUCache(cache_size, cache_ttl)
+
+    def resolve(self, session, model, gids):
+        """Resolves the provided gids of the given model, which must be
+        Recording, Release or Track.
+
+        Returns a dict mapping each gid to the current gid of the entity, or
+        to None if the gid refers to no entity.
+        """
+
+        result = {}
+        unresolved = []
+        for gid in set(gids):
+            found, current = self.cache.get((model, gid))
+            if found:
+                result[gid] = current
+            else:
+                unresolved.append(gid)
+
+        if not unresolved:
+            return result
+
+        redirect = REDIRECTS[model]
+
+        direct = session.query(
+            model.gid.label('gid'), model.gid.label('current_gid')
+        ).filter(model.gid.in_(unresolved))
+        redirected = session.query(
+            redirect.gid.label('gid'), model.gid.label('current_gid')
+        ).join(
+            model, redirect.new_id == model.id
+        ).filter(redirect.gid.in_(unresolved))
+
+        resolved = dict.fromkeys(unresolved)
+        resolved.update(direct.union_all(redirected))
+
+        for gid, current in resolved.items():
+            self.cache.set((model, gid), current)
+
+        result.update(resolved)
+        return result
+
+    def recordings(self, session, gids):
+        return self.resolve(session, Recording, gids)
+
+    def releases(self, session, gids):
+        return self.resolve(session, Release, gids)
+
+    def tracks(self, session, gids):
+        return self.resolve(session, Track, gids)
+
+    def clear(self):
+        """Clears the cache, for example after MusicBrainz replication."""
+        self.cache.clear()
@@ -0,0 +1,471 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module provides a local, memory-mapped store of the full waveforms
+and matching metadata of every WavePlot, built from the database, so that
+matching workers can compare against reference waveforms without each
+holding its own copy. Every process opening a store shares the same page
+cache.
+
+A store is a directory containing:
+
+* full.bin, the full waveforms, appended end to end;
+* records.bin, a fixed-size RECORD_DTYPE record for each WavePlot,
+  locating its waveform in full.bin;
+* an index directory for each update, holding the record numbers of the
+  stored WavePlots sorted by gid and by sonic hash, with the sorted keys, as
+  .npy files;
+* state.json, naming the current index directory, and the number of
+  records and bytes of full.bin it covers.
+
+Each update compares every WavePlot in the database with its record. The
+records of WavePlots whose metadata changed, such as sonic hashes rewritten
+by wpschema.regenerate, are rewritten in place. A changed waveform is
+appended to full.bin, and the old one's space is only reclaimed by building
+a new store. WavePlots no longer in the database, such as those merged away
+by wpschema.migrate.unique_image_hashes, are marked DELETED and left out of
+the index.
+
+Only update writes to a store, and only one update should run at a time.
+New records and waveforms are appended, and state.json is replaced last, so
+an interrupted update is discarded by the next one. Rewritten records are
+written just before state.json, and are seen by readers straight away, so
+readers should reload after an update.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import uuid
+
+import numpy
+from sqlalchemy import select
+
+from wpschema import matching
+from wpschema.waveplot import WavePlot, WavePlotData
+
+DEFAULT_BATCH_SIZE = 1000
+
+RECORD_DTYPE = numpy.dtype([
+    ('gid', 'S16'),
+    ('offset', '<i8'),
+    ('length', '<i4'),
+    ('sonic_hash', '<i4'),
+    ('num_channels', '<i2'),
+    ('duration', '<f8'),
+    ('image_hash', 'S20'),
+])
+
+# The length recorded for a WavePlot which has been deleted.
+DELETED = -1
+
+_RELOAD_ATTEMPTS = 3
+
+STATE = 'state.json'
+FULL = 'full.bin'
+RECORDS = 'records.bin'
+
+
+def _gid_bytes(value):
+    # numpy strips trailing null bytes from 'S' values.
+    return bytes(value).ljust(16, b'\0')
+
+
+def _image_hash_bytes(value):
+    return bytes(value).ljust(20, b'\0')
+
+
+def _read_state(directory):
+    path = os.path.join(directory, STATE)
+    if not os.path.exists(path):
+        return {'count': 0, 'full_size': 0, 'generation': 0, 'index': None}
+
+    with open(path) as state:
+        return json.load(state)
+
+
+class Reference(object):
+    """A WavePlot in a ReferenceStore. full is a read-only view of the
+    memory mapped waveform, and duration is in seconds. References can be
+    passed to the functions of wpschema.matching.
+    """
+
+    __slots__ = ('gid', 'duration', 'num_channels', 'sonic_hash', 'full')
+
+    def __init__(self, gid, duration, num_channels, sonic_hash, full):
+        self.gid = gid
+        self.duration = duration
+        self.num_channels = num_channels
+        self.sonic_hash = sonic_hash
+        self.full = full
+
+    def __repr__(self):
+        return '<Reference {!r}>'.format(self.gid)
+
+
+class ReferenceStore(object):
+    """Read-only access to a reference store. It can be used in place of a
+    wpschema.matching.SonicHashIndex, for example by
+    wpschema._waveplot.WavePlot.match. Call reload to see later updates.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.reload()
+
+    def reload(self):
+        # An update may replace the index named by the state before it's
+        # opened, in which case the new state names the new index.
+        for attempt in range(_RELOAD_ATTEMPTS):
+            try:
+                self._open(_read_state(self.directory))
+                return
+            except (IOError, OSError):
+                if attempt == _RELOAD_ATTEMPTS - 1:
+                    raise
+
+    def _open(self, state):
+        self.count = state['count']
+
+        if not self.count:
+            self.records = numpy.zeros(0, dtype=RECORD_DTYPE)
+            self.waveforms = numpy.zeros(0, dtype=numpy.uint8)
+            self.gid_keys = numpy.zeros(0, dtype='S16')
+            self.gid_rows = numpy.zeros(0, dtype=numpy.int64)
+            self.hash_keys = numpy.zeros(0, dtype=numpy.int32)
+            self.hash_rows = numpy.zeros(0, dtype=numpy.int64)
+            return
+
+        self.records = numpy.memmap(
+            os.path.join(self.directory, RECORDS), dtype=RECORD_DTYPE,
+            mode='r', shape=(self.count,)
+        )
+        self.waveforms = numpy.memmap(os.path.join(self.directory, FULL),
+                                      dtype=numpy.uint8, mode='r')
+
+        index = os.path.join(self.directory, state['index'])
+        self.gid_keys = numpy.load(os.path.join(index, 'gid_keys.npy'),
+                                   mmap_mode='r')
+        self.gid_rows = numpy.load(os.path.join(index, 'gid_rows.npy'),
+                                   mmap_mode='r')
+        self.hash_keys = numpy.load(os.path.join(index, 'hash_keys.npy'),
+                                    mmap_mode='r')
+        self.hash_rows = numpy.load(os.path.join(index, 'hash_rows.npy'),
+                                    mmap_mode='r')
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, row):
+        record = self.records[row]
+        offset = int(record['offset'])
+        length = max(int(record['length']), 0)
+
+        # The record was rewritten to a waveform appended since full.bin
+        # was mapped.
+        if offset + length > len(self.waveforms):
+            self.waveforms = numpy.memmap(
+                os.path.join(self.directory, FULL), dtype=numpy.uint8,
+                mode='r'
+            )
+
+        return Reference(
+            uuid.UUID(bytes=_gid_bytes(record['gid'])),
+            float(record['duration']), int(record['num_channels']),
+            int(record['sonic_hash']), self.waveforms[offset:offset + length]
+        )
+
+    def find(self, gid):
+        """Returns the row of the WavePlot with the provided gid, or None if
+        it isn't in the store.
+        """
+
+        key = numpy.array(gid.bytes, dtype='S16')
+        position = numpy.searchsorted(self.gid_keys, key)
+        if position == len(self.gid_keys) or \
+                _gid_bytes(self.gid_keys[position]) != gid.bytes:
+            return None
+
+        # The WavePlot may have been deleted since the index was opened.
+        row = int(self.gid_rows[position])
+        if self.records[row]['length'] == DELETED:
+            return None
+        return row
+
+    def get(self, gid):
+        """Returns the Reference with the provided gid, or None."""
+
+        row = self.find(gid)
+        return None if row is None else self[row]
+
+    def candidates(self, sonic_hash, duration, num_channels,
+                   radius=matching.DEFAULT_RADIUS,
+                   duration_tolerance=matching.DEFAULT_DURATION_TOLERANCE):
+        """Returns a Reference for each stored WavePlot within radius bits
+        of sonic_hash which has the same number of channels and a duration
+        within duration_tolerance seconds, like
+        wpschema.matching.SonicHashIndex.candidates.
+        """
+
+        duration = matching.duration_seconds(duration)
+
+        neighbours = numpy.array(
+            matching.hash_neighbours(sonic_hash, radius), dtype=numpy.int32
+        )
+        starts = numpy.searchsorted(self.hash_keys, neighbours, 'left')
+        stops = numpy.searchsorted(self.hash_keys, neighbours, 'right')
+
+        rows = [self.hash_rows[start:stop]
+                for start, stop in zip(starts, stops) if stop > start]
+        if not rows:
+            return []
+
+        rows = numpy.concatenate(rows)
+        records = self.records[rows]
+        matches = rows[
+            (records['length'] != DELETED) &
+            (records['num_channels'] == num_channels) &
+            (numpy.abs(records['duration'] - duration) <= duration_tolerance)
+        ]
+
+        return [self[row] for row in matches]
+
+
+def _select_metadata():
+    return select([
+        WavePlot.gid, WavePlot.duration, WavePlot.num_channels,
+        WavePlot.sonic_hash, WavePlot.image_hash
+    ])
+
+
+def _select_waveplots():
+    return select([
+        WavePlot.gid, WavePlot.duration, WavePlot.num_channels,
+        WavePlot.sonic_hash, WavePlot.image_hash, WavePlotData.full
+    ]).select_from(
+        WavePlot.__table__.join(WavePlotData.__table__)
+    )
+
+
+class _Writer(object):
+    """Appends and rewrites the records of a store, then writes a new index
+    and state.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.state = _read_state(directory)
+        self.count = self.state['count']
+        self.full_size = self.state['full_size']
+
+        # Discard anything appended by an interrupted update.
+        self.records_file = open(os.path.join(directory, RECORDS), 'ab')
+        self.records_file.truncate(self.count * RECORD_DTYPE.itemsize)
+        self.full_file = open(os.path.join(directory, FULL), 'ab')
+        self.full_file.truncate(self.full_size)
+
+        self.store = ReferenceStore(directory)
+        self.seen = numpy.zeros(self.count, dtype=bool)
+        self.rewrites = {}
+
+    def compare(self, rows):
+        """Takes a list of (gid, duration, num_channels, sonic_hash,
+        image_hash) rows from the database. Rewrites the records of those
+        whose waveform is stored but whose other metadata changed, and
+        returns the gids of the rest, whose waveforms must be passed to
+        write.
+        """
+
+        gids = []
+        for gid, duration, num_channels, sonic_hash, image_hash in rows:
+            row = self.store.find(gid)
+            if row is None:
+                gids.append(gid)
+                continue
+            self.seen[row] = True
+
+            record = self.store.records[row]
+            duration = matching.duration_seconds(duration)
+            image_hash = _image_hash_bytes(image_hash)
+
+            # A record rewritten by an interrupted update may locate a
+            # waveform which has since been discarded.
+            end = int(record['offset']) + int(record['length'])
+            if end > self.state['full_size'] or \
+                    _image_hash_bytes(record['image_hash']) != image_hash:
+                gids.append(gid)
+            elif (int(record['sonic_hash']), int(record['num_channels']),
+                  float(record['duration'])) != (sonic_hash, num_channels,
+                                                 duration):
+                self.rewrites[row] = (
+                    gid.bytes, record['offset'], record['length'],
+                    sonic_hash, num_channels, duration, image_hash
+                )
+
+        return gids
+
+    def write(self, rows):
+        """Appends the waveforms of a list of (gid, duration, num_channels,
+        sonic_hash, image_hash, full) rows. Records are appended for new
+        WavePlots, and rewritten for those already stored. Returns the number
+        of WavePlots written.
+        """
+
+        records = []
+        for gid, duration, num_channels, sonic_hash, image_hash, full in rows:
+            full = bytes(full)
+            self.full_file.write(full)
+            record = (
+                gid.bytes, self.full_size, len(full), sonic_hash,
+                num_channels, matching.duration_seconds(duration),
+                _image_hash_bytes(image_hash)
+            )
+            self.full_size += len(full)
+
+            row = self.store.find(gid)
+            if row is None:
+                records.append(record)
+            else:
+                self.rewrites[row] = record
+
+        if records:
+            self.records_file.write(
+                numpy.array(records, dtype=RECORD_DTYPE).tobytes()
+            )
+            self.count += len(records)
+
+        return len(rows)
+
+    def _write_index(self, index, records):
+        index_path = os.path.join(self.directory, index)
+        if os.path.isdir(index_path):
+            shutil.rmtree(index_path)
+        os.makedirs(index_path)
+
+        stored = numpy.flatnonzero(records['length'] != DELETED)
+        for name, keys in (('gid', records['gid']),
+                           ('hash', records['sonic_hash'])):
+            keys = keys[stored]
+            rows = numpy.argsort(keys, kind='mergesort')
+            numpy.save(os.path.join(index_path, name + '_keys.npy'),
+                       numpy.ascontiguousarray(keys[rows]))
+            numpy.save(os.path.join(index_path, name + '_rows.npy'),
+                       stored[rows].astype(numpy.int64))
+
+    def commit(self):
+        """Marks the stored WavePlots which weren't passed to compare as
+        DELETED, rewrites changed records, then writes the index and the
+        state which makes the update visible to readers. Returns the number
+        of WavePlots deleted.
+        """
+
+        for output in (self.full_file, self.records_file):
+            output.flush()
+            os.fsync(output.fileno())
+
+        stored = numpy.asarray(self.store.gid_rows)
+        deleted = stored[~self.seen[stored]]
+
+        previous = self.state['index']
+        if self.count == self.state['count'] and not self.rewrites and \
+                not len(deleted):
+            return 0
+
+        records = numpy.memmap(
+            os.path.join(self.directory, RECORDS), dtype=RECORD_DTYPE,
+            mode='r+', shape=(self.count,)
+        )
+        for row, record in self.rewrites.items():
+            records[row] = record
+        records['length'][deleted] = DELETED
+        records.flush()
+
+        generation = self.state['generation'] + 1
+        index = 'index-{:012d}'.format(generation)
+        self._write_index(index, records)
+        del records
+
+        self.state = {
+            'count': self.count,
+            'full_size': self.full_size,
+            'generation': generation,
+            'index': index,
+        }
+
+        descriptor, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(descriptor, 'w') as state:
+            json.dump(self.state, state)
+        os.rename(temp_path, os.path.join(self.directory, STATE))
+
+        # Readers which already have the old index mapped keep their view.
+        if previous is not None:
+            shutil.rmtree(os.path.join(self.directory, previous),
+                          ignore_errors=True)
+
+        return len(deleted)
+
+    def close(self):
+        self.full_file.close()
+        self.records_file.close()
+
+
+def update(engine, directory, batch_size=DEFAULT_BATCH_SIZE):
+    """Builds the reference store in directory, or brings it up to date.
+
+    The metadata of every WavePlot is read in gid order, batch_size at a
+    time, each batch in its own short transaction, and compared with the
+    store. The full waveforms of new WavePlots, and of those whose image
+    hash changed, are fetched and appended. The records of those whose
+    other metadata changed are rewritten, and WavePlots which are no longer
+    in the database are marked DELETED. Returns the number of WavePlots
+    written and the number deleted.
+    """
+
+    writer = _Writer(directory)
+    try:
+        written = 0
+        after = None
+        while True:
+            statement = _select_metadata().order_by(
+                WavePlot.gid
+            ).limit(batch_size)
+            if after is not None:
+                statement = statement.where(WavePlot.gid > after)
+
+            with engine.connect() as connection:
+                rows = connection.execute(statement).fetchall()
+                if not rows:
+                    break
+
+                gids = writer.compare(rows)
+                if gids:
+                    written += writer.write(connection.execute(
+                        _select_waveplots().where(WavePlot.gid.in_(gids))
+                    ).fetchall())
+
+            after = rows[-1][0]
+
+        deleted = writer.commit()
+    finally:
+        writer.close()
+
+    return written, deleted
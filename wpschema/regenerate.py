@@ -0,0 +1,284 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2014  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""This module provides a job which regenerates the preview, thumbnail,
+sonic hash and image hash of WavePlots from their stored full waveforms, for
+example after a new WavePlot version changes how they are derived.
+
+WavePlots of the selected versions are read a batch at a time in gid
+order, each batch in its own short transaction, derived in a pool of
+processes, and written back with one batched UPDATE per batch, each in its
+own transaction. After each batch is committed, its last gid is recorded in
+a checkpoint file, along with the job's settings, so an interrupted job run
+again with the same settings continues where it left off.
+
+Deriving the data needs libwaveplot, which must be of the version set on
+the regenerated WavePlots. The new sonic hashes reach a reference store
+(see wpschema.reference) when it's next updated, which the script can do
+once the job is done. Run as a script:
+
+    python -m wpschema.regenerate --database postgresql:///waveplot \\
+        --version CITRUS --to-version DAMSON --checkpoint regenerate.json \\
+        --reference /var/lib/waveplot/reference
+"""
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import uuid
+
+from sqlalchemy import bindparam, create_engine, select
+
+from wpschema import _waveplot, reference
+from wpschema.waveplot import WAVEPLOT_VERSIONS, WavePlot, WavePlotData
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def _derive_batch(rows):
+    """Derives the data of a list of (gid, full) tuples, returning a list of
+    UPDATE parameter dicts.
+    """
+
+    results = []
+    for gid, full in rows:
+        waveplot = _waveplot.WavePlot()
+        waveplot.full = full
+        waveplot.derive_all()
+
+        results.append({
+            'b_gid': gid,
+            'b_preview': waveplot.preview,
+            'b_thumbnail': waveplot.thumbnail,
+            'b_sonic_hash': waveplot.sonic_hash,
+            'b_image_hash': waveplot.get_image_hash().digest(),
+        })
+
+    return results
+
+
+def _select_waveplots(versions, after):
+    statement = select([
+        WavePlot.gid, WavePlotData.full
+    ]).select_from(
+        WavePlot.__table__.join(WavePlotData.__table__)
+    ).where(
+        WavePlot.version.in_(versions)
+    ).order_by(WavePlot.gid)
+
+    if after is not None:
+        statement = statement.where(WavePlot.gid > after)
+
+    return statement
+
+
+def _update_waveplots(to_version):
+    table = WavePlot.__table__
+
+    values = {
+        'preview': bindparam('b_preview'),
+        'thumbnail': bindparam('b_thumbnail'),
+        'sonic_hash': bindparam('b_sonic_hash'),
+        'image_hash': bindparam('b_image_hash'),
+    }
+    if to_version is not None:
+        values['version'] = to_version
+
+    return table.update().where(
+        table.c.gid == bindparam('b_gid')
+    ).values(values)
+
+
+def _settings(versions, to_version):
+    return {'versions': sorted(versions), 'to_version': to_version}
+
+
+def load_checkpoint(path, versions, to_version=None):
+    """Returns the last gid recorded in a checkpoint file, or None if there
+    isn't one. Raises ValueError if the checkpoint was recorded by a job
+    with different versions or to_version.
+    """
+
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as checkpoint:
+        data = json.load(checkpoint)
+
+    settings = _settings(versions, to_version)
+    recorded = dict((key, data.get(key)) for key in settings)
+    if recorded != settings:
+        raise ValueError(
+            "Checkpoint {} was recorded with {!r}, not {!r}".format(
+                path, recorded, settings
+            )
+        )
+
+    return uuid.UUID(data['gid'])
+
+
+def save_checkpoint(path, gid, versions, to_version=None):
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(descriptor, 'w') as checkpoint:
+        json.dump(dict(_settings(versions, to_version), gid=str(gid)),
+                  checkpoint)
+    os.rename(temp_path, path)
+
+
+def check_version(to_version):
+    """Raises ValueError unless libwaveplot can be loaded, and derives data
+    of version to_version.
+    """
+
+    if _waveplot.WavePlot.lib is None:
+        try:
+            _waveplot.WavePlot._init_libwaveplot()
+        except OSError as e:
+            raise ValueError("libwaveplot can't be loaded: {}".format(e))
+
+    version = _waveplot._text(_waveplot.WavePlot.lib.version())
+    if version != to_version:
+        raise ValueError("libwaveplot is version {}, not {}".format(
+            version, to_version
+        ))
+
+
+def regenerate(engine, versions, to_version=None, processes=None,
+               batch_size=DEFAULT_BATCH_SIZE, checkpoint=None):
+    """Regenerates the derived data of every WavePlot whose version is in
+    versions, also setting the version to to_version if it's provided.
+
+    Derivation is spread across processes worker processes (by default, one
+    per CPU), with at most two batches per process in flight, so memory use
+    doesn't grow with the size of the table. If checkpoint is the path of a
+    file, WavePlots up to the gid recorded in it are skipped, and it's
+    updated after each batch. A checkpoint recorded with other versions or
+    to_version, or a libwaveplot of a version other than to_version, raises
+    ValueError.
+
+    Yields a (last gid, number of WavePlots updated) tuple as each batch is
+    committed.
+    """
+
+    after = None
+    if checkpoint:
+        after = load_checkpoint(checkpoint, versions, to_version)
+
+    if to_version is not None:
+        check_version(to_version)
+
+    update = _update_waveplots(to_version)
+
+    processes = processes or multiprocessing.cpu_count()
+    max_pending = 2 * processes
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = collections.deque()
+
+        def write(result):
+            rows = result.get()
+            with engine.begin() as connection:
+                connection.execute(update, rows)
+
+            last_gid = rows[-1]['b_gid']
+            if checkpoint:
+                save_checkpoint(checkpoint, last_gid, versions, to_version)
+            return last_gid, len(rows)
+
+        while True:
+            # Each batch is read in its own transaction, rather than
+            # holding one open for the whole job.
+            with engine.connect() as connection:
+                rows = [(gid, bytes(full)) for gid, full in connection.execute(
+                    _select_waveplots(versions, after).limit(batch_size)
+                )]
+            if not rows:
+                break
+
+            after = rows[-1][0]
+            pending.append(pool.apply_async(_derive_batch, (rows,)))
+
+            if len(pending) >= max_pending:
+                yield write(pending.popleft())
+
+        while pending:
+            yield write(pending.popleft())
+
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Regenerate the previews, thumbnails and hashes of '
+                    'WavePlots from their full waveforms.'
+    )
+    parser.add_argument('--database', required=True,
+                        help='SQLAlchemy URL of the WavePlot database')
+    parser.add_argument('--version', dest='versions', action='append',
+                        choices=WAVEPLOT_VERSIONS,
+                        help='version of WavePlots to regenerate; may be '
+                             'repeated (default: all but the latest)')
+    parser.add_argument('--to-version', choices=WAVEPLOT_VERSIONS,
+                        default=None,
+                        help='version to set on regenerated WavePlots')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of worker processes (default: CPUs)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--checkpoint', default=None,
+                        help='file recording progress, to resume from')
+    parser.add_argument('--reference', default=None,
+                        help='directory of a reference store to update '
+                             'once the WavePlots are regenerated')
+    args = parser.parse_args(argv)
+
+    versions = args.versions or WAVEPLOT_VERSIONS[:-1]
+
+    engine = create_engine(args.database)
+
+    total = 0
+    try:
+        for last_gid, count in regenerate(engine, versions, args.to_version,
+                                          args.processes, args.batch_size,
+                                          args.checkpoint):
+            total += count
+            sys.stderr.write('{} WavePlots regenerated, up to {}\n'.format(
+                total, last_gid
+            ))
+    except ValueError as e:
+        sys.stderr.write('Error: {}\n'.format(e))
+        return 1
+
+    if args.reference:
+        written, deleted = reference.update(engine, args.reference)
+        sys.stderr.write('Reference store updated: {} WavePlots written, '
+                         '{} deleted\n'.format(written, deleted))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2014 Ben Ockmore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Scans directories of audio files for WavePlots, spreading the decoding
+across a pool of processes.
+
+Run as a script, results are written to standard output as JSON lines:
+
+    python -m wpschema.scan -j 32 --state scanned.jsonl /music
+
+Files listed in the state file with an unchanged modification time are
+skipped, and a short record of each new result is appended to it: the path,
+modification time, status and the image hash identifying the WavePlot, which
+can be generated again from the file if it's needed.
+"""
+
+import argparse
+import base64
+import json
+import multiprocessing
+import multiprocessing.util
+import os
+import sys
+
+from wpschema._waveplot import Generator, _text
+
+AUDIO_EXTENSIONS = (
+    '.aac', '.aif', '.aiff', '.ape', '.flac', '.m4a', '.mp3', '.mpc', '.ogg',
+    '.opus', '.wav', '.wma', '.wv'
+)
+
+
+def find_audio_files(root, extensions=AUDIO_EXTENSIONS):
+    """Yields the path of every audio file below root."""
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in extensions:
+                yield os.path.abspath(os.path.join(dirpath, filename))
+
+
+def _encode(value):
+    if value is None:
+        return None
+    return base64.b64encode(value).decode('ascii')
+
+
+# Each worker process keeps one Generator, reusing its native structures for
+# every file it scans, and frees it when the worker exits.
+_generator = None
+
+
+def _worker_generator():
+    global _generator
+    if _generator is None:
+        _generator = Generator()
+        multiprocessing.util.Finalize(None, _generator.close, exitpriority=10)
+    return _generator
+
+
+def _scan_file(item):
+    path, mtime = item
+
+    # The Generator is created here rather than in a pool initializer, as
+    # the pool replaces workers whose initializer fails, forever if
+    # libwaveplot can't be loaded. Instead, each file gets an error result.
+    try:
+        waveplot = _worker_generator().generate(path)
+        waveplot.derive_all()
+    except (IOError, OSError, MemoryError) as e:
+        return {'path': path, 'mtime': mtime, 'error': str(e)}
+
+    return {
+        'path': path,
+        'mtime': mtime,
+        'duration': waveplot.duration,
+        'dr_level': waveplot.dr_level,
+        'source_type': _text(waveplot.source_type),
+        'sample_rate': waveplot.sample_rate,
+        'bit_depth': waveplot.bit_depth,
+        'bit_rate': waveplot.bit_rate,
+        'num_channels': waveplot.num_channels,
+        'version': _text(waveplot.version),
+        'image_hash': waveplot.image_hash,
+        'sonic_hash': waveplot.sonic_hash,
+        'full': _encode(waveplot.full),
+        'preview': _encode(waveplot.preview),
+        'thumbnail': _encode(waveplot.thumbnail),
+    }
+
+
+def scan(roots, known=None, processes=None, extensions=AUDIO_EXTENSIONS):
+    """Scans every audio file below the provided root directories, using a
+    pool of processes (by default, one per CPU).
+
+    known may be a dict mapping paths to modification times, and files
+    whose modification time matches are skipped. A result dict is yielded
+    for each file as soon as it has been scanned, so results are not in
+    path order. Files which fail to scan have an 'error' key.
+    """
+
+    known = known or {}
+
+    def pending():
+        for root in roots:
+            for path in find_audio_files(root, extensions):
+                mtime = os.path.getmtime(path)
+                if known.get(path) != mtime:
+                    yield path, mtime
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(_scan_file, pending()):
+            yield result
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        # Workers left to exit normally free their Generators.
+        pool.close()
+    finally:
+        pool.join()
+
+
+def state_record(result):
+    """Returns the record of a scan result kept in a state file."""
+
+    return {
+        'path': result['path'],
+        'mtime': result['mtime'],
+        'status': 'error' if 'error' in result else 'ok',
+        'image_hash': result.get('image_hash'),
+    }
+
+
+def load_state(path):
+    """Reads a dict of paths to modification times from a JSON lines file of
+    state records, leaving out files which failed to scan.
+    """
+
+    known = {}
+    if os.path.exists(path):
+        with open(path) as state:
+            for line in state:
+                record = json.loads(line)
+                if record['status'] == 'ok':
+                    known[record['path']] = record['mtime']
+    return known
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Scan directories of audio files for WavePlots.'
+    )
+    parser.add_argument('roots', nargs='+', metavar='DIRECTORY')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of scanning processes (default: CPUs)')
+    parser.add_argument('--state', default=None,
+                        help='JSON lines file recording previous scans; '
+                             'files in it are skipped and new ones added')
+    args = parser.parse_args(argv)
+
+    known = load_state(args.state) if args.state else {}
+
+    state = open(args.state, 'a') if args.state else None
+    try:
+        for result in scan(args.roots, known, args.processes):
+            sys.stdout.write(json.dumps(result, sort_keys=True) + '\n')
+            if state is not None:
+                state.write(json.dumps(state_record(result),
+                                       sort_keys=True) + '\n')
+                state.flush()
+    finally:
+        if state is not None:
+            state.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
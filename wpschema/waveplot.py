@@ -17,16 +17,20 @@
 
 
 """This module defines the database models for tables within the waveplot
-schema, including WavePlot, WavePlotContext, Edit, Editor and Question.
+schema, including WavePlot, WavePlotData, WavePlotContext, Edit, Editor and
+Question.
 """
 
-from sqlalchemy import (Boolean, Column, DateTime, Enum, ForeignKey, Integer,
-                        Interval, SmallInteger, String, UnicodeText)
+from sqlalchemy import (Boolean, Column, DateTime, Enum, ForeignKey, Index,
+                        Integer, Interval, SmallInteger, String, UnicodeText,
+                        event)
 from sqlalchemy.dialects.postgresql import UUID, BYTEA
-from sqlalchemy.orm import relationship
+from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.orm import Load, defaultload, deferred, relationship
 from sqlalchemy.sql import text as sql_text
 
 from wpschema.base import Base
+from wpschema.partition import ensure_edit_partitions
 
 
 WAVEPLOT_VERSIONS = [
@@ -34,6 +38,15 @@ WAVEPLOT_VERSIONS = [
     u"DAMSON",
 ]
 
+# Named sets of deferred WavePlot data to load. The thumbnail is always
+# loaded, while the preview and full waveform are only loaded on access unless
+# a profile including them is selected (see load_profile).
+LOAD_PROFILES = {
+    'thumbnail': (),
+    'preview': ('preview',),
+    'full': ('preview', 'full'),
+}
+
 
 class Edit(Base):
     """Respresents an Edit.
@@ -41,16 +54,27 @@ class Edit(Base):
     An edit is any modification of WavePlot data by an Editor, whether that's
     uploading a new waveplot, adding tempo information to a track, or linking
     a WavePlot to various MusicBrainz entities.
+
+    The edit table is range partitioned by month on time, so the time is
+    part of the primary key. Partitions are managed by wpschema.partition.
     """
 
     __tablename__ = 'edit'
-    __table_args__ = {'schema': 'waveplot'}
+    __table_args__ = (
+        # Edits by an editor, or for a waveplot, in time order. The other
+        # columns are included so that these can be index-only scans.
+        Index('edit_idx_editor_time', 'editor_id', 'time',
+              postgresql_include=['id', 'type', 'waveplot_gid']),
+        Index('edit_idx_waveplot_time', 'waveplot_gid', 'time',
+              postgresql_include=['id', 'type', 'editor_id']),
+        {'schema': 'waveplot', 'postgresql_partition_by': 'RANGE (time)'}
+    )
 
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
 
     type = Column(SmallInteger, nullable=False)
 
-    time = Column(DateTime, nullable=False,
+    time = Column(DateTime, primary_key=True,
                   server_default=sql_text("(now() at time zone 'utc')"))
 
     editor_id = Column(Integer, ForeignKey('waveplot.editor.id'),
@@ -67,6 +91,20 @@ class Edit(Base):
         return '<Edit {!r} at {!r}>'.format(self.type, self.time)
 
 
+@event.listens_for(Edit.__table__, 'after_create')
+def _create_edit_partitions(target, connection, **kw):
+    # Only PostgreSQL partitions the table.
+    if connection.dialect.name != 'postgresql':
+        return
+
+    # The default partition catches edits outside of the monthly partitions,
+    # so that inserts never fail for want of a partition.
+    connection.execute(sql_text(
+        "CREATE TABLE waveplot.edit_default PARTITION OF waveplot.edit DEFAULT"
+    ))
+    ensure_edit_partitions(connection)
+
+
 class Editor(Base):
     """Represents an Editor.
 
@@ -101,7 +139,14 @@ class WavePlot(Base):
     """
 
     __tablename__ = 'waveplot'
-    __table_args__ = {'schema': 'waveplot'}
+    __table_args__ = (
+        # Supports sonic hash candidate lookups, which probe a set of hashes
+        # and then narrow by channel count and duration (see
+        # wpschema.matching).
+        Index('waveplot_idx_sonic_hash', 'sonic_hash', 'num_channels',
+              'duration'),
+        {'schema': 'waveplot'}
+    )
 
     gid = Column(UUID(as_uuid=True), primary_key=True)
 
@@ -119,10 +164,9 @@ class WavePlot(Base):
 
     dr_level = Column(SmallInteger, nullable=False)
 
-    image_hash = Column(BYTEA(20), nullable=False)
+    image_hash = Column(BYTEA(20), nullable=False, unique=True)
 
-    full = Column(BYTEA, nullable=False)
-    preview = Column(BYTEA(400), nullable=False)
+    preview = deferred(Column(BYTEA(400), nullable=False), group='preview')
     thumbnail = Column(BYTEA(50), nullable=False)
     sonic_hash = Column(Integer, nullable=False)
 
@@ -134,17 +178,78 @@ class WavePlot(Base):
 
     contexts = relationship('WavePlotContext', backref="waveplot")
 
+    # The full waveform is stored in a separate table, to keep the waveplot
+    # table small for scans, but is still accessed as WavePlot.full on
+    # instances. WavePlot.full is not a column, so it can't be used in
+    # queries: use WavePlotData.full, joined on gid, in expressions such as
+    # query(WavePlotData.full), and load_profile('full') in place of
+    # undefer('full').
+    data = relationship('WavePlotData', uselist=False,
+                        cascade='all, delete-orphan')
+    full = association_proxy(
+        'data', 'full', creator=lambda full: WavePlotData(full=full)
+    )
+
     def __repr__(self):
         return '<WavePlot {!r}>'.format(self.gid)
 
 
+class WavePlotData(Base):
+    """Class to hold the full waveform data of a WavePlot, which is
+    stored apart from the WavePlot metadata and accessed through
+    WavePlot.full.
+    """
+
+    __tablename__ = 'waveplot_data'
+    __table_args__ = {'schema': 'waveplot'}
+
+    gid = Column(
+        UUID(as_uuid=True),
+        ForeignKey('waveplot.waveplot.gid', ondelete='CASCADE'),
+        primary_key=True
+    )
+
+    full = Column(BYTEA, nullable=False)
+
+    def __repr__(self):
+        return '<WavePlotData {!r}>'.format(self.gid)
+
+
+def load_profile(name, relationship=None):
+    """Returns a list of query options which load WavePlots using the named
+    profile from LOAD_PROFILES. If relationship is provided, the options
+    apply to WavePlots loaded through that relationship, for example
+    WavePlotContext.waveplot.
+    """
+
+    if relationship is None:
+        loader = Load(WavePlot)
+    else:
+        loader = defaultload(relationship)
+
+    options = []
+    for group in LOAD_PROFILES[name]:
+        if group == 'full':
+            options.append(loader.selectinload(WavePlot.data))
+        else:
+            options.append(loader.undefer_group(group))
+
+    return options
+
+
 class WavePlotContext(Base):
     """Represents a link between a WavePlot and a track, also storing the
     release, recording and artist credit to speed up searches and browsing.
     """
 
     __tablename__ = 'waveplot_context'
-    __table_args__ = {'schema': 'waveplot'}
+    __table_args__ = (
+        # Contexts for a waveplot, answered by an index-only scan.
+        Index('waveplot_context_idx_waveplot', 'waveplot_gid',
+              postgresql_include=['id', 'release_gid', 'recording_gid',
+                                  'track_gid', 'artist_credit_id']),
+        {'schema': 'waveplot'}
+    )
 
     id = Column(Integer, primary_key=True)
 